@@ -0,0 +1,284 @@
+import os
+import re
+import sys
+import glob
+import sqlite3
+import hashlib
+import argparse
+from pathlib import Path
+
+import session
+
+HISTORY_DIR = "history/"
+ARCHIVE_DIR = "archive"
+INDEX_FILE = "index.sqlite"
+
+COMPRESSION_LEVEL = 19
+DICT_SIZE = 112640  # zstd's default dictionary size
+MIN_DICT_SAMPLES = 32
+
+# Context files are a directory listing followed by one section per file.
+# Sections are the unit of deduplication: an unchanged file produces the same
+# block in every turn, so it is stored once across the whole archive.
+BLOCK_BOUNDARY = re.compile(r'(?=\n\n# (?:Content|Outline) of )')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dictionaries (id INTEGER PRIMARY KEY, path TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY, path TEXT NOT NULL, dict_id INTEGER);
+CREATE TABLE IF NOT EXISTS blocks (
+    hash TEXT PRIMARY KEY, segment_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL, length INTEGER NOT NULL, raw_length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, epoch INTEGER, kind TEXT, size INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS file_blocks (name TEXT NOT NULL, seq INTEGER NOT NULL, hash TEXT NOT NULL,
+    PRIMARY KEY (name, seq));
+"""
+
+def split_blocks(text):
+    """Split text into blocks that join back to exactly the original"""
+    return [block for block in BLOCK_BOUNDARY.split(text) if block]
+
+def split_raw(data):
+    """split_blocks for raw file contents, keeping every byte (line endings and invalid UTF-8 included)"""
+    return [block.encode('utf-8', 'surrogateescape')
+            for block in split_blocks(data.decode('utf-8', 'surrogateescape'))]
+
+class Archive:
+    """
+    Compacted store for history/: zstd-compressed segment files holding
+    deduplicated blocks, with a SQLite index giving the segment, offset and
+    length of every block so any single turn can be read back without
+    decompressing anything else.
+    """
+
+    def __init__(self, history_dir=HISTORY_DIR):
+        self.history_dir = history_dir
+        self.dir = os.path.join(history_dir, ARCHIVE_DIR)
+        Path(self.dir).mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.dir, INDEX_FILE))
+        self.db.executescript(SCHEMA)
+        self.dictionaries = {}
+        self.decompressors = {}
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _dictionary(self, dict_id):
+        import zstandard
+        if dict_id is None:
+            return None
+        if dict_id not in self.dictionaries:
+            path, = self.db.execute("SELECT path FROM dictionaries WHERE id = ?", (dict_id,)).fetchone()
+            with open(os.path.join(self.dir, path), 'rb') as f:
+                self.dictionaries[dict_id] = zstandard.ZstdCompressionDict(f.read())
+        return self.dictionaries[dict_id]
+
+    def _decompressor(self, dict_id):
+        import zstandard
+        if dict_id not in self.decompressors:
+            dictionary = self._dictionary(dict_id)
+            self.decompressors[dict_id] = (zstandard.ZstdDecompressor(dict_data=dictionary)
+                                           if dictionary else zstandard.ZstdDecompressor())
+        return self.decompressors[dict_id]
+
+    def latest_dictionary(self):
+        row = self.db.execute("SELECT MAX(id) FROM dictionaries").fetchone()
+        return row[0]
+
+    def train_dictionary(self, samples):
+        """Train a dictionary on sample blocks and register it, None if there are too few"""
+        import zstandard
+        if len(samples) < MIN_DICT_SAMPLES:
+            return None
+        try:
+            dictionary = zstandard.train_dictionary(DICT_SIZE, samples)
+        except zstandard.ZstdError as e:
+            print(f"Could not train a dictionary: {e}")
+            return None
+        cursor = self.db.execute("INSERT INTO dictionaries (path) VALUES ('')")
+        dict_id = cursor.lastrowid
+        path = f"dict-{dict_id:06d}.zdict"
+        with open(os.path.join(self.dir, path), 'wb') as f:
+            f.write(dictionary.as_bytes())
+        self.db.execute("UPDATE dictionaries SET path = ? WHERE id = ?", (path, dict_id))
+        return dict_id
+
+    def names(self, kind=None):
+        if kind:
+            rows = self.db.execute("SELECT name FROM files WHERE kind = ? ORDER BY epoch, name", (kind,))
+        else:
+            rows = self.db.execute("SELECT name FROM files ORDER BY epoch, name")
+        return [name for name, in rows]
+
+    def __contains__(self, name):
+        return self.db.execute("SELECT 1 FROM files WHERE name = ?", (name,)).fetchone() is not None
+
+    def read(self, name):
+        """Text of one archived file"""
+        return self.read_bytes(name).decode('utf-8', 'replace')
+
+    def read_bytes(self, name):
+        """Exact contents of one archived file, touching only the blocks it consists of"""
+        rows = self.db.execute(
+            "SELECT s.path, s.dict_id, b.offset, b.length, b.raw_length "
+            "FROM file_blocks fb JOIN blocks b ON b.hash = fb.hash JOIN segments s ON s.id = b.segment_id "
+            "WHERE fb.name = ? ORDER BY fb.seq", (name,)).fetchall()
+        if not rows and name not in self:
+            raise KeyError(name)
+        parts = []
+        handles = {}
+        try:
+            for path, dict_id, offset, length, raw_length in rows:
+                if path not in handles:
+                    handles[path] = open(os.path.join(self.dir, path), 'rb')
+                segment = handles[path]
+                segment.seek(offset)
+                parts.append(self._decompressor(dict_id).decompress(segment.read(length), max_output_size=raw_length))
+        finally:
+            for handle in handles.values():
+                handle.close()
+        return b"".join(parts)
+
+    def compact(self, paths, retrain=False):
+        """
+        Pack loose files into a new segment and delete them. Blocks already in
+        the archive are only referenced, not stored again. Returns
+        (files packed, new blocks stored, bytes in, bytes written).
+        """
+        import zstandard
+
+        originals = {}
+        files = {}
+        for path in paths:
+            with open(path, 'rb') as f:
+                originals[path] = f.read()
+            files[os.path.basename(path)] = split_raw(originals[path])
+
+        new_blocks = {}
+        for blocks in files.values():
+            for block in blocks:
+                digest = hashlib.sha256(block).hexdigest()
+                if digest not in new_blocks and not self.db.execute(
+                        "SELECT 1 FROM blocks WHERE hash = ?", (digest,)).fetchone():
+                    new_blocks[digest] = block
+
+        dict_id = self.latest_dictionary()
+        if dict_id is None or retrain:
+            dict_id = self.train_dictionary(list(new_blocks.values())) or dict_id
+
+        bytes_in = sum(len(data) for data in originals.values())
+        bytes_out = 0
+        with self.db:
+            segment_id = None
+            if new_blocks:
+                segment_id = self.db.execute("INSERT INTO segments (path, dict_id) VALUES ('', ?)", (dict_id,)).lastrowid
+                segment_path = f"segment-{segment_id:06d}.zst"
+                dictionary = self._dictionary(dict_id)
+                compressor = (zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+                              if dictionary else zstandard.ZstdCompressor(level=COMPRESSION_LEVEL))
+                tmp_path = os.path.join(self.dir, segment_path + ".tmp")
+                offset = 0
+                with open(tmp_path, 'wb') as segment:
+                    # One frame per block, so each block can be decompressed on its own
+                    for digest, raw in new_blocks.items():
+                        frame = compressor.compress(raw)
+                        segment.write(frame)
+                        self.db.execute("INSERT INTO blocks VALUES (?, ?, ?, ?, ?)",
+                                        (digest, segment_id, offset, len(frame), len(raw)))
+                        offset += len(frame)
+                    segment.flush()
+                    os.fsync(segment.fileno())
+                os.replace(tmp_path, os.path.join(self.dir, segment_path))
+                self.db.execute("UPDATE segments SET path = ? WHERE id = ?", (segment_path, segment_id))
+                bytes_out = offset
+
+            for name, blocks in files.items():
+                epoch, kind = session.parse_name(name)
+                self.db.execute("DELETE FROM file_blocks WHERE name = ?", (name,))
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                (name, int(epoch) if epoch else None, kind, sum(len(b) for b in blocks)))
+                for seq, block in enumerate(blocks):
+                    digest = hashlib.sha256(block).hexdigest()
+                    self.db.execute("INSERT INTO file_blocks VALUES (?, ?, ?)", (name, seq, digest))
+
+        # Only delete the loose files once the index transaction has committed
+        # and each one reads back byte for byte
+        for path in paths:
+            if self.read_bytes(os.path.basename(path)) != originals[path]:
+                raise RuntimeError(f"{path} does not read back from the archive unchanged, keeping it")
+            os.remove(path)
+        return len(files), len(new_blocks), bytes_in, bytes_out
+
+def loose_files(history_dir=HISTORY_DIR):
+    return sorted(glob.glob(os.path.join(history_dir, "*.txt")))
+
+def compact(history_dir=HISTORY_DIR, retrain=False):
+    """Pack every loose .txt file in history_dir into the archive"""
+    # One compaction per archive at a time, or two runs would pack the same files
+    with session.lock_dir(os.path.join(history_dir, ARCHIVE_DIR)):
+        paths = loose_files(history_dir)
+        if not paths:
+            return 0, 0, 0, 0
+        with Archive(history_dir) as archive:
+            return archive.compact(paths, retrain=retrain)
+
+def iter_documents(history_dir=HISTORY_DIR):
+    """
+    Yield (path, name, content) for every file of the history, loose files
+    first, then archived ones, including those of named sessions below
+    history_dir. This is what history readers such as search.py should use
+    instead of globbing history/ directly.
+    """
+    for path in glob.glob(os.path.join(history_dir, "**/*.txt"), recursive=True):
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                yield path, os.path.basename(path), f.read()
+        except FileNotFoundError:
+            # Compacted meanwhile, so it is read from the archive below
+            continue
+    indexes = glob.glob(os.path.join(history_dir, "**", ARCHIVE_DIR, INDEX_FILE), recursive=True)
+    for index in sorted(indexes):
+        session_dir = os.path.dirname(os.path.dirname(index))
+        with Archive(session_dir) as archive:
+            for name in archive.names():
+                yield os.path.join(session_dir, ARCHIVE_DIR, name), name, archive.read(name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compacted, compressed archive of history/")
+    parser.add_argument("--dir", default=HISTORY_DIR, help="History directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Pack loose history files into the archive")
+    compact_parser.add_argument("--retrain", action="store_true", help="Train a new compression dictionary")
+    subparsers.add_parser("list", help="List archived files")
+    cat_parser = subparsers.add_parser("cat", help="Print archived files")
+    cat_parser.add_argument("names", nargs='+')
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        packed, blocks, bytes_in, bytes_out = compact(args.dir, args.retrain)
+        if packed:
+            print(f"Packed {packed} files ({bytes_in} bytes) into {blocks} new blocks ({bytes_out} bytes compressed)")
+        else:
+            print("Nothing to compact")
+    elif args.command == "list":
+        with Archive(args.dir) as archive:
+            for name in archive.names():
+                print(name)
+    elif args.command == "cat":
+        with Archive(args.dir) as archive:
+            for name in args.names:
+                try:
+                    sys.stdout.buffer.write(archive.read_bytes(name))
+                except KeyError:
+                    print(f"Not in the archive: {name}", file=sys.stderr)
+                    return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
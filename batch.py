@@ -0,0 +1,303 @@
+import os
+import sys
+import io
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import conductor
+import session
+from mock_provider import mock_completion
+
+BATCH_DIR = "batches/"
+POLL_INTERVAL = 30
+MAX_TOKENS = 1500
+TEMPERATURE = 0.7
+
+def load_config():
+    if os.path.exists('config.json'):
+        with open('config.json', 'r') as f:
+            return json.load(f)
+    return {}
+
+def load_jobs(jsonl_file):
+    """
+    Read prompts from a JSONL file.
+
+    Each line is either a bare JSON string or an object like
+    {"prompt": "...", "dir": "path/to/repo", "model": "...", "max_tokens": 1500}
+    where everything but "prompt" is optional.
+    """
+    jobs = []
+    with open(jsonl_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {"prompt": entry}
+            jobs.append(entry)
+    return jobs
+
+def build_contexts(jobs, workers=4):
+    """Gather the repository context once per distinct directory, in parallel"""
+    exclusions = conductor.load_exclusions()
+    dirs = sorted({job.get("dir", ".") for job in jobs})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        contexts = pool.map(lambda d: conductor.gather_context(exclusions, root_dir=d), dirs)
+        return dict(zip(dirs, contexts))
+
+def prepare_requests(jobs, contexts, model, max_tokens=MAX_TOKENS):
+    """
+    Turn jobs into request dicts keyed by a unique dialogue id and save their
+    prompt/context files the same way conductor does for a single prompt.
+    """
+    preamble = conductor.load_preamble() if os.path.exists(conductor.PREAMBLE_FILE) else ""
+    base = session.next_id()
+    requests_ = []
+    for job in jobs:
+        # A regular turn id, so results land in the history like any other turn
+        key = session.next_id()
+        final_prompt = f"{preamble}\n\n{job['prompt']}\n\n{contexts[job.get('dir', '.')]}"
+        session.atomic_write(os.path.join(conductor.DIALOGUE_DIR, f"{key}-context.txt"), final_prompt)
+        session.atomic_write(os.path.join(conductor.DIALOGUE_DIR, f"{key}-prompt.txt"), job['prompt'])
+        requests_.append({
+            "key": key,
+            "model": job.get("model", model),
+            "max_tokens": job.get("max_tokens", max_tokens),
+            "messages": [{"role": "user", "content": final_prompt}]
+        })
+    return base, requests_
+
+class OpenAIBatch:
+    """Submits through the OpenAI batch endpoint (/v1/batches)"""
+
+    def __init__(self, config):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=config.get("openai_api_key"))
+
+    def submit(self, requests_):
+        lines = []
+        for req in requests_:
+            lines.append(json.dumps({
+                "custom_id": req["key"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": req["model"],
+                    "messages": req["messages"],
+                    "max_tokens": req["max_tokens"],
+                    "temperature": TEMPERATURE
+                }
+            }))
+        upload = self.client.files.create(
+            file=("batch.jsonl", io.BytesIO("\n".join(lines).encode('utf-8'))),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def poll(self, batch_id):
+        """Return {key: response text or None on failure} once done, else None"""
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            return None
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                if response.get("status_code") == 200:
+                    body = response["body"]
+                    results[entry["custom_id"]] = body["choices"][0]["message"]["content"].strip()
+                else:
+                    results[entry["custom_id"]] = None
+        return results
+
+class AnthropicBatch:
+    """Submits through the Anthropic Message Batches API"""
+
+    def __init__(self, config):
+        from anthropic import Anthropic
+        self.client = Anthropic(api_key=config.get("anthropic_api_key"))
+
+    def submit(self, requests_):
+        batch = self.client.messages.batches.create(requests=[
+            {
+                "custom_id": req["key"],
+                "params": {
+                    "model": req["model"],
+                    "max_tokens": req["max_tokens"],
+                    "messages": req["messages"]
+                }
+            }
+            for req in requests_
+        ])
+        return batch.id
+
+    def poll(self, batch_id):
+        batch = self.client.messages.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            return None
+        results = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = entry.result.message.content[0].text.strip()
+            else:
+                results[entry.custom_id] = None
+        return results
+
+class LocalBatch:
+    """
+    Fallback for providers without a batch API: sends each request through
+    the composer with bounded concurrency, in the scheduler's batch lane.
+    """
+
+    def __init__(self, provider, server_url=conductor.SERVER_URL, concurrency=4):
+        self.provider = provider
+        self.server_url = server_url
+        self.concurrency = concurrency
+        self.pending = {}
+
+    def _send(self, req):
+        """Response text for one request, None if it failed; never raises"""
+        import requests
+        try:
+            response = requests.post(
+                f"{self.server_url}/generate",
+                json={
+                    "messages": req["messages"],
+                    "max_tokens": req["max_tokens"],
+                    "temperature": TEMPERATURE,
+                    "provider": self.provider,
+                    "model": req["model"],
+                    "priority": "batch",
+                    "request_id": req["key"]
+                },
+                headers={"Content-Type": "application/json"}
+            )
+            result = response.json() if response.status_code == 200 else {}
+        except (requests.RequestException, ValueError) as e:
+            # One failed request must not take the rest of the batch down with it
+            print(f"Request {req['key']} failed: {e}")
+            return None
+        if result.get("success", False):
+            return result.get("content", "")
+        print(f"Request {req['key']} failed: {result.get('error', response.text)}")
+        return None
+
+    def submit(self, requests_):
+        batch_id = f"local-{requests_[0]['key']}" if requests_ else "local-empty"
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            self.pending[batch_id] = dict(zip(
+                (req["key"] for req in requests_),
+                pool.map(self._send, requests_)
+            ))
+        return batch_id
+
+    def poll(self, batch_id):
+        # Local batches finish inside submit, there is nothing to resume
+        return self.pending.pop(batch_id, {})
+
+class MockBatch(LocalBatch):
+    """In-process batch backend for testing, no server or API key needed"""
+
+    def __init__(self, concurrency=4):
+        super().__init__("mock", concurrency=concurrency)
+
+    def _send(self, req):
+        return mock_completion(req["messages"], req["model"])[0]
+
+def get_backend(provider, config, server_url=conductor.SERVER_URL, concurrency=4):
+    if provider == "openai":
+        return OpenAIBatch(config)
+    if provider == "anthropic":
+        return AnthropicBatch(config)
+    if provider == "mock":
+        return MockBatch(concurrency=concurrency)
+    return LocalBatch(provider, server_url=server_url, concurrency=concurrency)
+
+def manifest_path(base):
+    return os.path.join(BATCH_DIR, f"{base}.json")
+
+def save_manifest(base, provider, batch_id, keys, session_name=None):
+    Path(BATCH_DIR).mkdir(exist_ok=True)
+    with open(manifest_path(base), 'w') as f:
+        json.dump({"provider": provider, "batch_id": batch_id, "keys": keys, "session": session_name}, f, indent=2)
+
+def wait_for_results(backend, batch_id, poll_interval=POLL_INTERVAL):
+    while True:
+        results = backend.poll(batch_id)
+        if results is not None:
+            return results
+        print(f"Batch {batch_id} still running, checking again in {poll_interval}s")
+        time.sleep(poll_interval)
+
+def save_results(keys, results):
+    """Write every response through conductor's normal response layout"""
+    saved = 0
+    for key in keys:
+        text = results.get(key)
+        if text is None:
+            print(f"No response for {key}")
+            continue
+        conductor.save_response_components(key, text)
+        saved += 1
+    return saved
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit many prompts at once through provider batch APIs")
+    parser.add_argument("jobs", nargs='?', help="JSONL file of prompts")
+    parser.add_argument("-p", "--provider", default="openai", choices=["openai", "anthropic", "openrouter", "mock"])
+    parser.add_argument("-m", "--model", default="gpt-4o", help="Default model for prompts that do not set one")
+    parser.add_argument("-s", "--server", default=conductor.SERVER_URL, help="Composer URL for the local executor")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Parallel requests for the local executor")
+    parser.add_argument("--poll-interval", type=int, default=POLL_INTERVAL, help="Seconds between status checks")
+    parser.add_argument("--resume", help="Resume polling a submitted batch from its manifest in batches/")
+    parser.add_argument("-S", "--session", help="Named session to save the prompts and responses in")
+    args = parser.parse_args()
+
+    config = load_config()
+
+    if args.resume:
+        with open(args.resume, 'r') as f:
+            manifest = json.load(f)
+        conductor.use_session(manifest.get("session"))
+        backend = get_backend(manifest["provider"], config, args.server, args.concurrency)
+        batch_id, keys = manifest["batch_id"], manifest["keys"]
+    else:
+        if not args.jobs:
+            parser.error("a JSONL file of prompts is required unless --resume is given")
+        conductor.use_session(args.session)
+        Path(conductor.DIALOGUE_DIR).mkdir(parents=True, exist_ok=True)
+        jobs = load_jobs(args.jobs)
+        if not jobs:
+            print(f"No prompts found in {args.jobs}")
+            return 1
+        contexts = build_contexts(jobs)
+        base, requests_ = prepare_requests(jobs, contexts, args.model)
+        keys = [req["key"] for req in requests_]
+
+        backend = get_backend(args.provider, config, args.server, args.concurrency)
+        batch_id = backend.submit(requests_)
+        save_manifest(base, args.provider, batch_id, keys, args.session)
+        print(f"Submitted {len(keys)} prompts as batch {batch_id} (manifest: {manifest_path(base)})")
+
+    results = wait_for_results(backend, batch_id, args.poll_interval)
+    saved = save_results(keys, results)
+    print(f"Saved {saved}/{len(keys)} responses")
+    return 0 if saved == len(keys) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
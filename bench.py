@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+from pathlib import Path
+from contextlib import contextmanager
+
+BENCH_DIR = "benchmarks/"
+
+# Cold import of conductor must stay under this many seconds, and must not pull
+# in any of the heavy modules below; they belong on the code paths that use them.
+IMPORT_BUDGET = 0.1
+HEAVY_MODULES = ["PIL", "requests", "openai", "anthropic", "selenium", "langchain", "faiss", "tiktoken"]
+# Rate limits given to the mock provider while benchmarking the round trip
+UNLIMITED = 10 ** 12
+
+WORDS = ["def", "return", "class", "import", "self", "value", "context", "prompt",
+         "response", "history", "for", "in", "if", "else", "print", "path", "file"]
+
+@contextmanager
+def working_directory(path):
+    """conductor and search resolve everything relative to the cwd"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def random_text(rng, size):
+    lines = []
+    length = 0
+    while length < size:
+        line = " " * (4 * rng.randint(0, 3)) + " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size]
+
+def make_repo(root, files=200, file_size=4000, binary_ratio=0.1, depth=3, seed=0):
+    """Create a synthetic repository of text and binary files under root"""
+    rng = random.Random(seed)
+    dirs = [Path(root)]
+    for level in range(depth):
+        for i in range(3):
+            parent = rng.choice(dirs)
+            child = parent / f"dir{level}_{i}"
+            child.mkdir(parents=True, exist_ok=True)
+            dirs.append(child)
+
+    for i in range(files):
+        directory = rng.choice(dirs)
+        if rng.random() < binary_ratio:
+            (directory / f"blob{i}.bin").write_bytes(rng.randbytes(file_size))
+        else:
+            (directory / f"module{i}.py").write_text(random_text(rng, file_size))
+
+    # The conductor expects its own support files next to the repository
+    Path(root, "exclude.txt").write_text("dialogue\nhistory\nhistory_index\n")
+    Path(root, "preamble.txt").write_text("You are a benchmark.\n")
+    Path(root, "config.json").write_text(json.dumps({"openai_api_key": "", "anthropic_api_key": "", "openrouter_api_key": ""}))
+
+def make_history(root, turns=20, turn_size=2000, summary=True, seed=0):
+    """Create a dialogue/ directory with alternating prompt and response files"""
+    rng = random.Random(seed)
+    dialogue = Path(root, "dialogue")
+    history = Path(root, "history")
+    dialogue.mkdir(exist_ok=True)
+    history.mkdir(exist_ok=True)
+    base = 1700000000
+    for i in range(turns):
+        for kind in ("prompt", "response"):
+            path = dialogue / f"{base + i}-{kind}.txt"
+            path.write_text(random_text(rng, turn_size))
+            os.utime(path, (base + i, base + i))
+        # Archived copies are what search.py indexes
+        shutil.copy(dialogue / f"{base + i}-prompt.txt", history)
+        shutil.copy(dialogue / f"{base + i}-response.txt", history)
+    if summary:
+        path = dialogue / f"{base}-summary.txt"
+        path.write_text(random_text(rng, turn_size))
+        os.utime(path, (base, base))
+
+def make_image(path, width=1200, height=20000):
+    from PIL import Image
+    Image.new("RGB", (width, height), (200, 120, 40)).save(path)
+
+def measure(fn, repeat=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "max": max(samples),
+        "samples": samples
+    }
+
+@contextmanager
+def mock_composer(root, latency=0.0):
+    """Serve composer on a free local port, answering with the mock provider"""
+    from werkzeug.serving import make_server
+    with working_directory(root):
+        import composer
+        import mock_provider
+    mock_provider.LATENCY = latency
+    # The mock provider has no upstream limits; keep the scheduler from
+    # throttling large benchmark prompts so the round trip is what gets timed
+    composer.scheduler.limits["mock"] = {"rpm": UNLIMITED, "tpm": UNLIMITED}
+    composer.scheduler.queues.pop(("mock", "mock"), None)
+    server = make_server("127.0.0.1", 0, composer.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/api"
+    finally:
+        server.shutdown()
+        mock_provider.LATENCY = 0.0
+
+def bench_gather_context(root, repeat):
+    import conductor
+    with working_directory(root):
+        exclusions = conductor.load_exclusions()
+        return measure(lambda: conductor.gather_context(exclusions), repeat)
+
+def bench_directory_structure(root, repeat):
+    import conductor
+    with working_directory(root):
+        return measure(lambda: conductor.generate_directory_structure('.', conductor.EXCLUDE_FILE), repeat)
+
+def bench_message_history(root, repeat):
+    import conductor
+    with working_directory(root):
+        return measure(conductor.gather_message_history, repeat)
+
+def bench_process_image(root, repeat):
+    import conductor
+    image = os.path.join(root, "bench-image.png")
+    make_image(image)
+    return measure(lambda: conductor.process_image(image), repeat)
+
+def bench_search_index(root, repeat):
+    import search
+    from langchain_community.embeddings import FakeEmbeddings
+    embeddings = FakeEmbeddings(size=384)
+    with working_directory(root):
+        documents = search.load_documents("history")
+
+        def build():
+            shutil.rmtree("history_index", ignore_errors=True)
+            search.create_or_load_index(documents, embeddings, "history_index")
+
+        return measure(build, repeat)
+
+def bench_composer_roundtrip(root, repeat, latency=0.0):
+    import conductor
+    with mock_composer(root, latency) as server_url, working_directory(root):
+        exclusions = conductor.load_exclusions()
+        prompt = f"benchmark prompt\n\n{conductor.gather_context(exclusions)}"
+        return measure(lambda: conductor.send_request_to_server(
+            prompt, server_url=server_url, provider="mock", model="mock"), repeat)
+
+def bench_conductor_import(root, repeat):
+    """Time `import conductor` in a fresh interpreter and check it against IMPORT_BUDGET"""
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = (
+        "import sys, json, time\n"
+        "start = time.perf_counter()\n"
+        "import conductor\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(json.dumps({'elapsed': elapsed, 'heavy': heavy}))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=here, PYTHONDONTWRITEBYTECODE="1")
+    runs = []
+
+    def cold_start():
+        output = subprocess.run([sys.executable, "-c", code], cwd=root, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+
+    # Wall time includes interpreter startup; the budget applies to the import itself
+    result = measure(cold_start, repeat)
+    imports = [run["elapsed"] for run in runs[-repeat:]]
+    result["import_median"] = statistics.median(imports)
+    result["heavy_modules"] = runs[-1]["heavy"]
+    result["budget"] = IMPORT_BUDGET
+    result["within_budget"] = result["import_median"] <= IMPORT_BUDGET and not result["heavy_modules"]
+    if not result["within_budget"]:
+        print(f"conductor import is over budget: {result['import_median'] * 1000:.1f} ms, "
+              f"heavy modules loaded: {result['heavy_modules'] or 'none'}")
+    return result
+
+BENCHMARKS = {
+    "conductor_import": bench_conductor_import,
+    "gather_context": bench_gather_context,
+    "generate_directory_structure": bench_directory_structure,
+    "gather_message_history": bench_message_history,
+    "process_image": bench_process_image,
+    "search.create_or_load_index": bench_search_index,
+    "composer_roundtrip": bench_composer_roundtrip,
+}
+
+def run(params, only=None, repeat=5):
+    results = {}
+    root = tempfile.mkdtemp(prefix="reich-bench-")
+    try:
+        make_repo(root, params["files"], params["file_size"], params["binary_ratio"], params["depth"], params["seed"])
+        make_history(root, params["turns"], params["turn_size"], seed=params["seed"])
+        for name, bench in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            try:
+                results[name] = bench(root, repeat)
+                print(f"{name:32} median {results[name]['median'] * 1000:10.2f} ms")
+            except ImportError as e:
+                # Optional dependency for this benchmark is not installed
+                results[name] = {"skipped": str(e)}
+                print(f"{name:32} skipped ({e})")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prompt pipeline on synthetic repositories")
+    parser.add_argument("--files", type=int, default=200, help="Number of files in the synthetic repository")
+    parser.add_argument("--file-size", type=int, default=4000, help="Size of each file in bytes")
+    parser.add_argument("--binary-ratio", type=float, default=0.1, help="Fraction of files that are binary")
+    parser.add_argument("--depth", type=int, default=3, help="Directory nesting depth")
+    parser.add_argument("--turns", type=int, default=20, help="Dialogue turns in the synthetic history")
+    parser.add_argument("--turn-size", type=int, default=2000, help="Size of each prompt/response in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed, keep fixed to compare runs")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--only", nargs='+', choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("-o", "--output", help=f"JSON results file (default: {BENCH_DIR}<epoch>.json)")
+    args = parser.parse_args()
+
+    params = {
+        "files": args.files,
+        "file_size": args.file_size,
+        "binary_ratio": args.binary_ratio,
+        "depth": args.depth,
+        "turns": args.turns,
+        "turn_size": args.turn_size,
+        "seed": args.seed,
+    }
+    # Benchmarks chdir into the synthetic repo, so make sure our modules stay importable
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    started = time.time()
+    results = run(params, args.only, args.repeat)
+    report = {
+        "timestamp": int(started),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+
+    over_budget = not results.get("conductor_import", {}).get("within_budget", True)
+
+    output = args.output or os.path.join(BENCH_DIR, f"{int(started)}.json")
+    Path(os.path.dirname(output) or ".").mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 1 if over_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
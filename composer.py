@@ -3,9 +3,12 @@ import json
 import time
 import base64
 from typing import Dict, Any, Optional, List
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from openai import OpenAI
 from anthropic import Anthropic
+from metrics import Registry
+from mock_provider import mock_completion
+from scheduler import Scheduler, estimate_tokens, INTERACTIVE
 
 app = Flask(__name__)
 
@@ -33,6 +36,144 @@ if anthropic_api_key:
 if openrouter_api_key:
     openrouter_client = OpenAI(base_url="https://openrouter.ai/api/v1",api_key=openrouter_api_key)
 
+# Requests wait here for provider capacity instead of failing on 429s.
+# Limits come from config.json, e.g. {"rate_limits": {"openai": {"rpm": 500, "tpm": 30000}}}
+scheduler = Scheduler(config.get("rate_limits", {}))
+QUEUE_TIMEOUT = config.get("queue_timeout", 600)
+RATE_LIMIT_RETRIES = 3
+
+registry = Registry()
+registry.describe('composer_requests_total', 'Requests to /api/generate by outcome')
+registry.describe('composer_queue_wait_seconds', 'Time spent waiting for provider capacity')
+registry.describe('composer_upstream_latency_seconds', 'Time from sending upstream to the full response')
+registry.describe('composer_time_to_first_token_seconds', 'Time from sending upstream to the first streamed token')
+registry.describe('composer_tokens_total', 'Tokens reported by the provider')
+registry.describe('composer_cache_hits_total', 'Requests that were served partly from the prompt cache')
+
+def with_cache_breakpoints(messages):
+    """
+    Mark the end of the history and the end of the request as prompt cache
+    breakpoints, in the content-block format Anthropic (and OpenRouter for
+    Anthropic models) expects. Conversations only ever grow at the end, so
+    the next turn reads everything up to the previous breakpoint from the
+    cache instead of processing it again. OpenAI caches prefixes on its own.
+    """
+    marked = [dict(msg) for msg in messages]
+    for msg in marked[-2:]:
+        content = msg["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        content = [dict(block) for block in content]
+        if not content:
+            continue
+        content[-1]["cache_control"] = {"type": "ephemeral"}
+        msg["content"] = content
+    return marked
+
+def stream_openai(client, model, messages, max_tokens, temperature):
+    """Stream a chat completion so time-to-first-token can be measured"""
+    started = time.perf_counter()
+    ttft = None
+    parts = []
+    usage = None
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(chunk.choices[0].delta.content)
+        if chunk.usage:
+            usage = chunk.usage
+
+    stats = {'ttft': ttft}
+    if usage:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        stats.update({
+            'input_tokens': usage.prompt_tokens,
+            'output_tokens': usage.completion_tokens,
+            'cached_tokens': getattr(details, 'cached_tokens', 0) or 0
+        })
+    return "".join(parts).strip(), stats
+
+def call_provider(provider, model, messages, max_tokens, temperature):
+    """
+    Send one request upstream, returning (content, stats) or None if the
+    provider is unavailable. stats holds ttft and input/output/cached tokens
+    when the provider reports them.
+    """
+    if provider == 'anthropic' or (provider == 'openrouter' and model.startswith('anthropic/')):
+        messages = with_cache_breakpoints(messages)
+
+    if provider == 'openai' and openai_client:
+        return stream_openai(openai_client, model, messages, max_tokens, temperature)
+
+    elif provider == 'anthropic' and anthropic_client:
+        # Convert OpenAI message format to Anthropic format
+        anthropic_messages = []
+        for msg in messages:
+            anthropic_messages.append({
+                "role": msg["role"],
+                "content": msg["content"]
+            })
+
+        started = time.perf_counter()
+        ttft = None
+        parts = []
+        with anthropic_client.messages.stream(
+            model="claude-3-7-sonnet-20250219" if model == "default" else model,
+            max_tokens=max_tokens,
+            messages=anthropic_messages
+        ) as stream:
+            for text in stream.text_stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                parts.append(text)
+            usage = stream.get_final_message().usage
+
+        return "".join(parts).strip(), {
+            'ttft': ttft,
+            'input_tokens': usage.input_tokens,
+            'output_tokens': usage.output_tokens,
+            'cached_tokens': getattr(usage, 'cache_read_input_tokens', 0) or 0,
+            'cache_write_tokens': getattr(usage, 'cache_creation_input_tokens', 0) or 0
+        }
+
+    elif provider == 'openrouter' and openrouter_client:
+        return stream_openai(openrouter_client, model, messages, max_tokens, temperature)
+
+    elif provider == 'mock':
+        # Local provider for tests and benchmarks, never leaves the machine
+        content, tokens = mock_completion(messages, model)
+        return content, {'ttft': None, 'input_tokens': tokens - len(content) // 4, 'output_tokens': len(content) // 4}
+
+    return None
+
+def record_request(provider, model, lane, status, queue_wait, latency=None, stats=None):
+    labels = {'provider': provider, 'model': model}
+    registry.inc('composer_requests_total', status=status, lane=lane, **labels)
+    registry.observe('composer_queue_wait_seconds', queue_wait, lane=lane, **labels)
+    if latency is not None:
+        registry.observe('composer_upstream_latency_seconds', latency, **labels)
+    if not stats:
+        return
+    if stats.get('ttft') is not None:
+        registry.observe('composer_time_to_first_token_seconds', stats['ttft'], **labels)
+    for kind in ('input', 'output', 'cached', 'cache_write'):
+        if stats.get(f'{kind}_tokens'):
+            registry.inc('composer_tokens_total', stats[f'{kind}_tokens'], kind=kind, **labels)
+    if stats.get('cached_tokens'):
+        registry.inc('composer_cache_hits_total', **labels)
+
+def is_rate_limited(error):
+    return getattr(error, 'status_code', None) == 429
+
 @app.route('/api/generate', methods=['POST'])
 def generate():
     data = request.json
@@ -41,68 +182,76 @@ def generate():
     max_tokens = data.get('max_tokens', 1500)
     temperature = data.get('temperature', 0.7)
     provider = data.get('provider', 'openrouter')  # Default to OpenAI if not specified
-    
+    client = data.get('client') or request.remote_addr or 'anonymous'
+    lane = data.get('priority', INTERACTIVE)
+    request_id = data.get('request_id')
+
+    estimated = estimate_tokens(messages, max_tokens)
+
     try:
-        if provider == 'openai' and openai_client:
-            response = openai_client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
-            return jsonify({
-                'success': True,
-                'content': response.choices[0].message.content.strip(),
-                'model': model,
-                'provider': 'openai'
-            })
-            
-        elif provider == 'anthropic' and anthropic_client:
-            # Convert OpenAI message format to Anthropic format
-            anthropic_messages = []
-            for msg in messages:
-                anthropic_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            response = anthropic_client.messages.create(
-                model="claude-3-7-sonnet-20250219" if model == "default" else model,
-                max_tokens=max_tokens,
-                messages=anthropic_messages
-            )
-            
-            return jsonify({
-                'success': True,
-                'content': response.content[0].text.strip(),
-                'model': model,
-                'provider': 'anthropic'
-            })
-        elif provider == 'openrouter' and openrouter_client:
-            response = openrouter_client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            ticket = scheduler.acquire(provider, model, estimated, client=client, lane=lane,
+                                       ticket_id=request_id, timeout=QUEUE_TIMEOUT)
+            started = time.perf_counter()
+            try:
+                result = call_provider(provider, model, messages, max_tokens, temperature)
+            except Exception as e:
+                scheduler.release(ticket, rate_limited=is_rate_limited(e))
+                record_request(provider, model, lane, 'rate_limited' if is_rate_limited(e) else 'error',
+                               ticket.queue_wait, time.perf_counter() - started)
+                if is_rate_limited(e) and attempt < RATE_LIMIT_RETRIES:
+                    continue
+                raise
+            latency = time.perf_counter() - started
+            if result is None:
+                scheduler.release(ticket, actual_tokens=0)
+                record_request(provider, model, lane, 'unavailable', ticket.queue_wait)
+                return jsonify({
+                    'success': False,
+                    'error': f"Provider '{provider}' not available or no valid API keys found."
+                }), 400
+
+            content, stats = result
+            used = stats.get('input_tokens', 0) + stats.get('output_tokens', 0)
+            scheduler.release(ticket, actual_tokens=used or None)
+            record_request(provider, model, lane, 'success', ticket.queue_wait, latency, stats)
             return jsonify({
                 'success': True,
-                'content': response.choices[0].message.content.strip(),
+                'content': content,
                 'model': model,
-                'provider': 'openrouter'
+                'provider': provider,
+                'queue_position': ticket.initial_position,
+                'queue_wait': round(ticket.queue_wait, 3),
+                'metrics': dict(stats, queue_wait=ticket.queue_wait, upstream_latency=latency)
             })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f"Provider '{provider}' not available or no valid API keys found."
-            }), 400
-            
+
+    except TimeoutError as e:
+        registry.inc('composer_requests_total', status='queue_timeout', lane=lane, provider=provider, model=model)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/queue', methods=['GET'])
+def queue_status():
+    return jsonify(scheduler.snapshot())
+
+@app.route('/api/queue/<request_id>', methods=['GET'])
+def queue_position(request_id):
+    status = scheduler.position(request_id)
+    if status is None:
+        return jsonify({'success': False, 'error': f"Unknown request '{request_id}'"}), 404
+    return jsonify(status)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     available_providers = []
@@ -112,6 +261,7 @@ def health_check():
         available_providers.append('anthropic')
     if anthropic_client:
         available_providers.append('openrouter')
+    available_providers.append('mock')
         
     return jsonify({
         'status': 'ok',
@@ -1,9 +1,7 @@
 import os
 import time
 import argparse
-from PIL import Image
 import io
-import requests
 import json
 import sys
 import base64
@@ -12,11 +10,19 @@ from mimetypes import guess_type
 import re
 import glob
 import subprocess
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import getpass
+import uuid
 
-# Import the diarize module from the current project
-import diarize
-# import utility to 
-from url_fetch import capture_webpage
+import metrics
+import reader
+import session
+
+# PIL, requests, diarize (OpenAI client) and url_fetch (selenium) are slow to
+# import, so they are imported inside the functions that need them. A plain
+# text prompt then starts without loading any of them.
 
 # Constants
 DIALOGUE_DIR = "dialogue/"
@@ -24,10 +30,17 @@ PREAMBLE_FILE = "preamble.txt"
 EXCLUDE_FILE = "exclude.txt"
 GENERATED_DIR = "generated/"
 SERVER_URL = "http://localhost:5555/api"  # Default server URL
+CHUNK_SIZE = 1 << 16  # Bytes read/written at a time when streaming the context
+PREP_WORKERS = 8  # Threads for the preparation steps that run alongside the context
 
 def get_epoch_time():
     return str(int(time.time()))
 
+def use_session(name):
+    """Keep this run's dialogue in its own directory, apart from other sessions"""
+    global DIALOGUE_DIR
+    DIALOGUE_DIR, _ = session.session_dirs(name)
+
 def encode_image(image_path):
     mime_type, _ = guess_type(image_path)
     if mime_type is None:
@@ -38,6 +51,8 @@ def encode_image(image_path):
     return f"data:{mime_type};base64,{base64_encoded_data}"
 
 def process_image(image_path, max_height=7999):
+    from PIL import Image
+
     with Image.open(image_path) as img:
         width, height = img.size
         
@@ -60,19 +75,19 @@ def process_image(image_path, max_height=7999):
             return [encode_image(image_path)]
 
 def save_prompt(prompt_text, final_context):
-    epoch_time = get_epoch_time()
+    """
+    Save the prompt and the full context under a new turn id. final_context
+    may be a string or an iterable of chunks, which is written as it is
+    produced without joining it. Both files appear atomically; errors while
+    producing or writing the context propagate, and no turn is saved then.
+    """
+    epoch_time = session.next_id()
     prompt_file = os.path.join(DIALOGUE_DIR, f"{epoch_time}-prompt.txt")
     context_file = os.path.join(DIALOGUE_DIR, f"{epoch_time}-context.txt")
     
-    try:
-        with open(prompt_file, 'w') as f:
-            f.write(prompt_text)
-
-        with open(context_file, 'w') as f:
-            f.write(final_context)
-
-    except Exception as e:
-        print(f"Error saving files: {e}")
+    # The prompt goes last, so a turn never exists without its context
+    session.atomic_write(context_file, final_context)
+    session.atomic_write(prompt_file, prompt_text)
     
     return epoch_time, prompt_file, context_file
 
@@ -101,16 +116,16 @@ def generate_directory_structure(root_dir, exclude_file):
     command = f"tree {root_dir} {exclude_str} --prune"
     
     # Execute the tree command
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    with metrics.phase("tree"):
+        result = subprocess.run(command, shell=True, capture_output=True, text=True)
     
     return result.stdout
 
-def gather_context(exclusions):
-    # Generate the directory structure
-    dir_structure = generate_directory_structure('.', EXCLUDE_FILE)
-    context = f"Directory Structure:\n{dir_structure}"
-    
-    all_files = [f for f in glob.glob("**/*", recursive=True) if os.path.isfile(f)]
+def exclusion_filter(exclusions):
+    """
+    Return a predicate telling whether a relative path is excluded from the
+    context. Patterns with a dot match file names, the rest are directories.
+    """
     exclude_files = []
     exclude_dirs = []
     for pattern in exclusions:
@@ -119,34 +134,124 @@ def gather_context(exclusions):
         else:
             exclude_dirs.append(pattern)
 
-    # Append contents of files to the context, considering exclusions
-    for file in all_files:
+    def is_excluded(file):
         if any(file.startswith(excluded_dir) for excluded_dir in exclude_dirs):
-            continue
-        if any(glob.fnmatch.fnmatch(file, pattern) for pattern in exclude_files):
-            continue
-        with open(file, 'r', errors="ignore") as f:
-            context += f"\n\n# Content of {file}:\n"
-            context += f.read()
-    return context
-
-def gather_message_history():
-    files = sorted(glob.glob(os.path.join(DIALOGUE_DIR, "*.txt")), key=os.path.getmtime)
-    summaries = [f for f in files if "summary" in f]
-    prompts = [f for f in files if "prompt" in f]
-    responses = [f for f in files if "response" in f]
+            return True
+        return any(glob.fnmatch.fnmatch(file, pattern) for pattern in exclude_files)
+
+    return is_excluded
+
+def context_files(exclusions, root_dir='.'):
+    """Relative paths of the files the context is made of"""
+    is_excluded = exclusion_filter(exclusions)
+    all_files = [f for f in glob.glob("**/*", root_dir=root_dir, recursive=True)
+                 if os.path.isfile(os.path.join(root_dir, f))]
+    return [f for f in all_files if not is_excluded(f)]
+
+def iter_context(exclusions, root_dir='.', outline=None, dir_structure=None, max_size=reader.MAX_FILE_SIZE):
+    """
+    Yield the context (directory structure, then every file's content) piece
+    by piece, so it never has to be held in memory as a whole. Files are read
+    ahead on a thread pool; binaries and files over max_size bytes are replaced
+    by a one-line note. outline, if given, is called with each file's relative
+    and full path and returns a skeleton to send instead, or None.
+    dir_structure may be a Future for a `tree` already running elsewhere.
+    """
+    with metrics.phase("walk"):
+        files = context_files(exclusions, root_dir)
+
+    # Generate the directory structure
+    if dir_structure is None:
+        dir_structure = generate_directory_structure(root_dir, EXCLUDE_FILE)
+    elif hasattr(dir_structure, "result"):
+        dir_structure = dir_structure.result()
+    yield f"Directory Structure:\n{dir_structure}"
+
+    def load(file):
+        full_path = os.path.join(root_dir, file)
+        if outline:
+            skeleton = outline(file, full_path)
+            if skeleton is not None:
+                return skeleton, "outline"
+        return reader.load(full_path, max_size)
+
+    # Only time spent waiting for a file counts towards the phase, not time
+    # the consumer spends between files.
+    read_time = 0.0
+    size = 0
+    skipped = 0
+    loaded = reader.iter_loaded(files, load)
+    while True:
+        start = time.perf_counter()
+        file, (content, omitted) = next(loaded, (None, (None, None)))
+        read_time += time.perf_counter() - start
+        if file is None:
+            break
+        if omitted == "outline":
+            yield f"\n\n# Outline of {file} (bodies omitted):\n"
+        else:
+            yield f"\n\n# Content of {file}:\n"
+            skipped += omitted is not None
+        size += len(content)
+        yield content
+    metrics.current_trace().record("read", read_time)
+    metrics.current_trace().set(context_files=len(files), context_skipped=skipped, context_chars=size)
+
+def gather_context(exclusions, root_dir='.', max_size=reader.MAX_FILE_SIZE):
+    return "".join(iter_context(exclusions, root_dir, max_size=max_size))
 
+def iter_file(path):
+    with open(path, 'r', errors="ignore") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def iter_request_body(request_data, prompt_chunks):
+    """
+    Incrementally JSON-encode request_data, appending a final user message
+    whose content is streamed from prompt_chunks. Yields bytes.
+    """
+    fields = {key: value for key, value in request_data.items() if key != "messages"}
+    head = json.dumps(fields)[:-1]
+    yield f'{head}{", " if fields else ""}"messages": ['.encode('utf-8')
+    for message in request_data["messages"]:
+        yield (json.dumps(message) + ', ').encode('utf-8')
+    yield b'{"role": "user", "content": "'
+    for chunk in prompt_chunks:
+        # Encoding a string and dropping its quotes escapes it for embedding
+        yield json.dumps(chunk)[1:-1].encode('utf-8')
+    yield b'"}]}'
+
+def gather_message_history(context_epochs=()):
+    """
+    Build the message history from DIALOGUE_DIR. For turns listed in
+    context_epochs the saved context is sent instead of the bare prompt, which
+    is how git-incremental turns keep the snapshot they build on. Turns still
+    waiting for their response, e.g. from another run, are left out.
+    """
     message_history = []
 
-    if summaries:
-        with open(summaries[-1], 'r') as f:
-            message_history.append({"role": "assistant", "content": f.read().strip()})
+    # Shared lock: summarization must not move files away while they are read
+    with session.lock_dir(DIALOGUE_DIR, exclusive=False):
+        files = session.turn_files(DIALOGUE_DIR)
+        summaries = files.get("summary", {})
+        if summaries:
+            with open(summaries[max(summaries, key=int)], 'r') as f:
+                message_history.append({"role": "assistant", "content": f.read().strip()})
 
-    for p, r in zip(prompts, responses):
-        with open(p, 'r') as f:
-            message_history.append({"role": "user", "content": f.read().strip()})
-        with open(r, 'r') as f:
-            message_history.append({"role": "assistant", "content": f.read().strip()})
+        for turn_id in session.complete_turns(files):
+            if turn_id in context_epochs:
+                # Unstripped: byte for byte what that turn sent, so the provider's
+                # prompt cache recognizes it as the same prefix
+                with open(files["context"][turn_id], 'r') as f:
+                    message_history.append({"role": "user", "content": f.read()})
+            else:
+                with open(files["prompt"][turn_id], 'r') as f:
+                    message_history.append({"role": "user", "content": f.read().strip()})
+            with open(files["response"][turn_id], 'r') as f:
+                message_history.append({"role": "assistant", "content": f.read().strip()})
 
     return message_history
 
@@ -217,8 +322,7 @@ def save_response_components(epoch_time, response_text):
     """
     # Save the full response first
     response_file = os.path.join(DIALOGUE_DIR, f"{epoch_time}-response.txt")
-    with open(response_file, 'w') as f:
-        f.write(response_text)
+    session.atomic_write(response_file, response_text)
     
     # Create directories for components if they don't exist
     Path(GENERATED_DIR).mkdir(exist_ok=True)
@@ -291,66 +395,136 @@ def save_response_components(epoch_time, response_text):
     
     return response_file, None, None
 
-def send_request_to_server(prompt, image_paths=None, server_url=SERVER_URL, provider="openrouter", model="claude-3-7-sonnet-20250219"):
-    message_history = gather_message_history()
+def encode_images(image_paths):
+    """Data URLs of every image, tall ones split into several pieces"""
+    pieces = []
+    for image_path in image_paths:
+        with metrics.phase("image_encode"):
+            pieces.extend(process_image(image_path))
+    return pieces
+
+def image_message(piece, provider):
+    if provider == "anthropic":
+        return {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/png",
+                        "data": piece.split(",", 1)[1]
+                    }
+                }
+            ]
+        }
+    return {
+        "role": "user",
+        "content": [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": piece
+                }
+            }
+        ]
+    }
+
+def open_http_session(server_url=SERVER_URL):
+    """
+    Import requests and open a keep-alive connection to the composer, so the
+    request can go out on an established connection once the payload is ready.
+    """
+    import requests
+
+    http_session = requests.Session()
+    with metrics.phase("connect"):
+        try:
+            http_session.get(f"{server_url}/health", timeout=5)
+        except requests.exceptions.RequestException:
+            # The real request will report the problem
+            pass
+    return http_session
 
-    print("message_history", message_history)
+def report_cache(server_metrics):
+    """Print how much of the prompt the provider served from its cache"""
+    cached = server_metrics.get("cached_tokens") or 0
+    if not cached:
+        return
+    # Anthropic counts cache reads and writes apart from input_tokens, OpenAI includes them
+    total = server_metrics.get("input_tokens") or 0
+    if server_metrics.get("cache_write_tokens") is not None:
+        total += cached + server_metrics["cache_write_tokens"]
+    print(f"Prompt cache: {cached} of {max(total, cached)} input tokens read from cache")
+
+def send_request_to_server(prompt=None, image_paths=None, server_url=SERVER_URL, provider="openrouter", model="claude-3-7-sonnet-20250219", priority="interactive", prompt_file=None, message_history=None, image_pieces=None, http_session=None, request_id=None):
+    """
+    Send the prompt with the message history to the composer and return the
+    response text. With prompt_file the prompt is streamed from that file into
+    the request body instead of being passed in as a string. message_history
+    and image_pieces are loaded here unless the caller already has them, and
+    http_session may be a requests.Session with a warm connection. request_id
+    identifies the request in the composer's queue and is generated if not given.
+    """
+    if message_history is None:
+        with metrics.phase("history"):
+            message_history = gather_message_history()
+    else:
+        message_history = list(message_history)
+    metrics.current_trace().set(history_messages=len(message_history))
     
-    if image_paths:
-        for image_path in image_paths:
-            image_pieces = process_image(image_path)
-            for piece in image_pieces:
-                if provider == "anthropic":
-                    message_history.append({
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": piece.split(",", 1)[1]
-                                }
-                            }
-                        ]
-                    })
-                else:
-                    message_history.append({
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": piece
-                                }
-                            }
-                        ]
-                    })
+    if image_pieces is None:
+        image_pieces = encode_images(image_paths or [])
+    for piece in image_pieces:
+        message_history.append(image_message(piece, provider))
     
-    # Add the text prompt last
-    message_history.append({"role": "user", "content": prompt})
-
-    # Prepare request data
+    # Prepare request data, the text prompt is added last while streaming
     request_data = {
         "messages": message_history,
         "max_tokens": 1500,
         "temperature": 0.7,
         "provider": provider,
-        "model": model
+        "model": model,
+        # Used by the composer's scheduler for fair queueing between clients
+        "client": f"{getpass.getuser()}@{socket.gethostname()}",
+        "priority": priority,
+        # Lets the caller poll GET /api/queue/<request_id> while it waits
+        "request_id": request_id or uuid.uuid4().hex
     }
+    metrics.current_trace().set(request_id=request_data["request_id"])
+    print(f"Request {request_data['request_id']} sent, queue position at {server_url}/queue/{request_data['request_id']}")
     
+    import requests
+
+    prompt_chunks = iter_file(prompt_file) if prompt_file else [prompt]
+    request_bytes = 0
+
+    def body():
+        # Serialization is interleaved with sending, so it counts as network time
+        nonlocal request_bytes
+        for part in iter_request_body(request_data, prompt_chunks):
+            request_bytes += len(part)
+            yield part
+
     # Send request to server
     try:
-        response = requests.post(
-            f"{server_url}/generate",
-            json=request_data,
-            headers={"Content-Type": "application/json"}
-        )
+        with metrics.phase("network"):
+            response = (http_session or requests).post(
+                f"{server_url}/generate",
+                data=body(),
+                headers={"Content-Type": "application/json"}
+            )
+        metrics.current_trace().set(request_bytes=request_bytes)
         
         # Handle response
         if response.status_code == 200:
-            result = response.json()
+            with metrics.phase("parse"):
+                result = response.json()
             if result.get("success", False):
+                # Server-side timings (queue wait, upstream latency, tokens)
+                server_metrics = result.get("metrics", {})
+                metrics.current_trace().set(server=server_metrics)
+                report_cache(server_metrics)
                 return result.get("content", "")
             else:
                 error_msg = result.get("error", "Unknown error")
@@ -374,20 +548,92 @@ def guess_image_mime_type(encoded_image):
     else:
         return "application/octet-stream"  # Default to binary data if unknown
     
+def process_response(epoch_time, response_text):
+    """Save the response and its components, then print it with any patch/command hints"""
+    # Parse and save response components (JSON format if available)
+    with metrics.phase("save"):
+        response_file, patch_file, commands_file = save_response_components(epoch_time, response_text)
+    
+    # Extract and save code blocks if present
+    code_blocks = re.findall(r'```(.*?)```', response_text, re.DOTALL)
+    if code_blocks:
+        Path(GENERATED_DIR).mkdir(exist_ok=True)
+        for i, code_block in enumerate(code_blocks):
+            code_block = code_block.strip()
+            if code_block.startswith('python'):
+                extension = '.py'
+                content = code_block.split('\n', 1)[1] if '\n' in code_block else code_block
+            elif code_block.startswith('javascript'):
+                extension = '.js'
+                content = code_block.split('\n', 1)[1] if '\n' in code_block else code_block
+            else:
+                extension = '.txt'
+                content = code_block
+                
+            filename = os.path.join(GENERATED_DIR, f"{epoch_time}_{i}{extension}")
+            with open(filename, 'w') as file:
+                file.write(content)
+    
+    # Print the response
+    print("\n" + "="*50)
+    print("RESPONSE:")
+    print("="*50)
+    print(response_text)
+    
+    # Print information about any patches or commands
+    is_json, text, patch, commands = parse_json_response(response_text)
+    if is_json:
+        if patch:
+            patch_file = os.path.join("patches", f"{epoch_time}-patch.txt")
+            print(f"\nPatch file saved to: {patch_file}")
+            print("To apply the patch, run:")
+            print(f"  git apply {patch_file}")
+        
+        if commands:
+            print("\nCommands generated:")
+            for i, cmd in enumerate(commands):
+                cmd_file = os.path.join("commands", f"{epoch_time}-cmd{i+1}.sh")
+                print(f"  [{i+1}] {cmd} (saved to {cmd_file})")
+            print("\nTo run a command, execute:")
+            print(f"  bash commands/{epoch_time}-cmd#.sh")
+
+def timed(phase, fn, *args):
+    with metrics.phase(phase):
+        return fn(*args)
+
+def capture_and_encode(url):
+    from url_fetch import capture_webpage
+    with metrics.phase("capture"):
+        screenshot_path = capture_webpage(url)
+    return encode_images([screenshot_path])
+
 def main():
     """Main function to run the Reich client."""
-    Path(DIALOGUE_DIR).mkdir(exist_ok=True)
-    
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="Reich client for AI text generation")
     parser.add_argument('-f', '--file', default='prompt', help='File path to read prompt from')
     parser.add_argument("-i", "--images", nargs='+', required=False, help="Image files to send along with the prompt")
     parser.add_argument("-u", "--urls", nargs='+', required=False, help="URLs to capture screenshots from")
     parser.add_argument("-s", "--server", default=SERVER_URL, help=f"Server URL (default: {SERVER_URL})")
-    parser.add_argument("-p", "--provider", default="openrouter", choices=["auto", "openai", "openrouter", "anthropic"])
+    parser.add_argument("-p", "--provider", default="openrouter", choices=["auto", "openai", "openrouter", "anthropic", "mock"])
     parser.add_argument("-m", "--model", default="anthropic/claude-3.7-sonnet", help="Model to use")
+    parser.add_argument("-t", "--trace", action="store_true", help=f"Write per-phase timings to {metrics.TRACE_DIR}")
+    parser.add_argument("-k", "--skeleton", action="store_true", help="Send only signatures and docstrings of source files the prompt does not mention")
+    parser.add_argument("--pin", nargs='+', default=[], help="Files or directories always sent in full with --skeleton (added to pin.txt entries)")
+    parser.add_argument("-g", "--git", action="store_true", help="After the first turn, send only the changes since the previous turn (git repositories only)")
+    parser.add_argument("--max-file-size", type=int, default=reader.MAX_FILE_SIZE, help=f"Leave out files larger than this many bytes, 0 for no limit (default: {reader.MAX_FILE_SIZE})")
+    parser.add_argument("-S", "--session", help="Named session with its own dialogue history, for running several conductors on one tree")
+    parser.add_argument("-w", "--watch", action="store_true", help="Run as a daemon that keeps the context warm and answers prompts from a socket or prompt file changes")
 
     args = parser.parse_args()
+    use_session(args.session)
+    Path(DIALOGUE_DIR).mkdir(parents=True, exist_ok=True)
+    if args.watch:
+        if args.git or args.skeleton or args.pin or args.urls:
+            parser.error("--watch does not support -g, -k/--pin or -u")
+        import watch
+        return watch.serve(args)
+    trace = metrics.start_trace(get_epoch_time())
     
     # Process user input
     if args.file:
@@ -396,79 +642,79 @@ def main():
     else:
         user_prompt = input("\nEnter your prompt: ")
     
-    # Capture screenshots if URLs are provided
-    captured_images = []
-    if args.urls:
-        for url in args.urls:
-            screenshot_path = capture_webpage(url)
-            captured_images.append(screenshot_path)
-    
-    # Combine captured screenshots with provided images
-    image_paths = (args.images or []) + captured_images
-    # Load context
-    preamble = load_preamble() if os.path.exists(PREAMBLE_FILE) else ""
-    exclusions = load_exclusions()
-    context = gather_context(exclusions)
-    
-    # Prepare final prompt with context
-    final_prompt = f"{preamble}\n\n{user_prompt}\n\n{context}"
-    epoch_time, prompt_file, context_file = save_prompt(user_prompt, final_context=final_prompt)
+    # Everything but streaming the context runs in the background: URL
+    # captures and image encoding, `tree`, loading the history, and importing
+    # requests plus connecting to the server. Preparation then takes about as
+    # long as the slowest of these instead of their sum.
+    with ThreadPoolExecutor(max_workers=PREP_WORKERS) as pool:
+        http_future = pool.submit(open_http_session, args.server)
+        image_futures = [pool.submit(encode_images, [path]) for path in args.images or []]
+        image_futures += [pool.submit(capture_and_encode, url) for url in args.urls or []]
+        tree_future = pool.submit(generate_directory_structure, '.', EXCLUDE_FILE)
+
+        # Load context
+        preamble = load_preamble() if os.path.exists(PREAMBLE_FILE) else ""
+        exclusions = load_exclusions()
+        
+        snapshot = None
+        outline = None
+        history_future = None
+        if args.git:
+            import gitcontext
+            if gitcontext.is_git_repo():
+                snapshot = gitcontext.take_snapshot(exclusions, args.max_file_size)
+                history_future = pool.submit(timed, "history", gitcontext.gather_message_history, snapshot["chain"])
+            else:
+                print("Not a git repository, sending the full context")
+        if history_future is None:
+            history_future = pool.submit(timed, "history", gather_message_history)
+        
+        # Stream the final prompt with context straight into the context file; it
+        # is read back from there in chunks when the request body is sent
+        if snapshot and snapshot["mode"] == "diff":
+            # The preamble and full snapshot are already in the message history
+            final_prompt = itertools.chain([f"{user_prompt}\n\n"], gitcontext.iter_changes(snapshot, exclusions, args.max_file_size))
+        else:
+            if args.skeleton:
+                import skeleton
+                outline = skeleton.Outliner(user_prompt, skeleton.load_pins() + args.pin, args.max_file_size)
+            final_prompt = itertools.chain([f"{preamble}\n\n{user_prompt}\n\n"],
+                                           iter_context(exclusions, outline=outline, dir_structure=tree_future,
+                                                        max_size=args.max_file_size))
+        try:
+            with metrics.phase("save"):
+                epoch_time, prompt_file, context_file = save_prompt(user_prompt, final_context=final_prompt)
+        except Exception as e:
+            print(f"Error gathering context: {e}")
+            return 1
+        trace.run_id = epoch_time
+        if outline:
+            trace.set(context_outlined=outline.outlined)
+        if snapshot:
+            gitcontext.save_snapshot(epoch_time, snapshot)
+            trace.set(git_mode=snapshot["mode"], git_tree=snapshot["tree"])
+
+        try:
+            image_pieces = [piece for future in image_futures for piece in future.result()]
+            message_history = history_future.result()
+            http_session = http_future.result()
+        except Exception as e:
+            print(f"Error in processing: {e}")
+            return 1
 
     try:
         # Send request to AI server
         response_text = send_request_to_server(
-            prompt=final_prompt, 
-            image_paths=image_paths,
+            prompt_file=context_file,
+            image_pieces=image_pieces,
             server_url=args.server,
             provider=args.provider,
-            model=args.model
+            model=args.model,
+            message_history=message_history,
+            http_session=http_session
         )
         
-        # Parse and save response components (JSON format if available)
-        response_file, patch_file, commands_file = save_response_components(epoch_time, response_text)
-        
-        # Extract and save code blocks if present
-        code_blocks = re.findall(r'```(.*?)```', response_text, re.DOTALL)
-        if code_blocks:
-            Path(GENERATED_DIR).mkdir(exist_ok=True)
-            for i, code_block in enumerate(code_blocks):
-                code_block = code_block.strip()
-                if code_block.startswith('python'):
-                    extension = '.py'
-                    content = code_block.split('\n', 1)[1] if '\n' in code_block else code_block
-                elif code_block.startswith('javascript'):
-                    extension = '.js'
-                    content = code_block.split('\n', 1)[1] if '\n' in code_block else code_block
-                else:
-                    extension = '.txt'
-                    content = code_block
-                    
-                filename = os.path.join(GENERATED_DIR, f"{epoch_time}_{i}{extension}")
-                with open(filename, 'w') as file:
-                    file.write(content)
-        
-        # Print the response
-        print("\n" + "="*50)
-        print("RESPONSE:")
-        print("="*50)
-        print(response_text)
-        
-        # Print information about any patches or commands
-        is_json, text, patch, commands = parse_json_response(response_text)
-        if is_json:
-            if patch:
-                patch_file = os.path.join("patches", f"{epoch_time}-patch.txt")
-                print(f"\nPatch file saved to: {patch_file}")
-                print("To apply the patch, run:")
-                print(f"  git apply {patch_file}")
-            
-            if commands:
-                print("\nCommands generated:")
-                for i, cmd in enumerate(commands):
-                    cmd_file = os.path.join("commands", f"{epoch_time}-cmd{i+1}.sh")
-                    print(f"  [{i+1}] {cmd} (saved to {cmd_file})")
-                print("\nTo run a command, execute:")
-                print(f"  bash commands/{epoch_time}-cmd#.sh")
+        process_response(epoch_time, response_text)
         
         # Update conversation summary
         #jif 'diarize' in sys.modules:
@@ -477,6 +723,10 @@ def main():
     except Exception as e:
         print(f"Error in processing: {e}")
         return 1
+
+    finally:
+        if args.trace:
+            print(f"Trace written to {trace.write()}")
         
     return 0
 
@@ -1,23 +1,26 @@
-import os, re
-import time
-from openai import OpenAI
+import os
+import argparse
 from pathlib import Path
-import glob
 import shutil
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import session
 
 DIALOGUE_DIR = "dialogue/"
 HISTORY_DIR = "history/"
 
-def get_epoch_time():
-    return str(int(time.time()))
+_client = None
 
-def extract_digits_from_filename(filename):
-    match = re.match(r'dialogue/(\d+)-prompt.txt', filename)
-    if match:
-        return match.group(1)
-    return None
+def get_client():
+    """Create the OpenAI client on first use rather than at import time"""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+def use_session(name):
+    global DIALOGUE_DIR, HISTORY_DIR
+    DIALOGUE_DIR, HISTORY_DIR = session.session_dirs(name)
 
 def send_summary_request_to_openai(text, recent_summary):
     messages = [
@@ -27,7 +30,7 @@ def send_summary_request_to_openai(text, recent_summary):
     ]
     print(f"RECENT SUMMARY: {recent_summary}")
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4",
         messages=messages,
         max_tokens=1500,
@@ -36,51 +39,69 @@ def send_summary_request_to_openai(text, recent_summary):
     return response.choices[0].message.content.strip()
 
 def save_summary(summary_text):
-    epoch_time = get_epoch_time()
+    epoch_time = session.next_id()
     summary_file = os.path.join(DIALOGUE_DIR, f"{epoch_time}-summary.txt")
-    with open(summary_file, 'w') as f:
-        f.write(summary_text)
+    session.atomic_write(summary_file, summary_text)
     return summary_file
 
 def move_files_to_history(files):
-    Path(HISTORY_DIR).mkdir(exist_ok=True)
+    Path(HISTORY_DIR).mkdir(parents=True, exist_ok=True)
     for f in files:
         shutil.move(f, HISTORY_DIR)
 
+def compact_history():
+    """Pack the files just moved to history/ into the compressed archive"""
+    try:
+        import archive
+        packed, blocks, bytes_in, bytes_out = archive.compact(HISTORY_DIR)
+    except ImportError as e:
+        print(f"Skipping history compaction ({e})")
+        return
+    if packed:
+        print(f"Compacted {packed} files into the history archive ({bytes_in} -> {bytes_out} bytes)")
+
 def summarize_conversation():
-    files = sorted(glob.glob(os.path.join(DIALOGUE_DIR, "*.txt")), key=os.path.getmtime)
-    prompts = [f for f in files if "prompt" in f]
-    responses = [f for f in files if "response" in f]
-    summaries = [f for f in files if "summary" in f]
+    files = session.turn_files(DIALOGUE_DIR)
+    turns = session.complete_turns(files)
+    summaries = files.get("summary", {})
 
     recent_summary = ""
     if summaries:
-        with open(summaries[-1], 'r') as f:
+        with open(summaries[max(summaries, key=int)], 'r') as f:
             recent_summary = f.read().strip()
 
-    # This should queue off of responses, as there is a lag between prompts and responses
-    if len(responses) > 5:
+    # Only turns that already have a response count; other runs may still be
+    # waiting for theirs
+    if len(turns) > 5:
         text = ""
-        for i in range(len(responses)):
-            key = extract_digits_from_filename(prompts[i])
-            p = prompts[i]
-            print(f"prompts: {p}")
-            print(f"key {key}")
-            with open(prompts[i], 'r') as f:
+        for turn_id in turns:
+            print(f"prompts: {files['prompt'][turn_id]}")
+            with open(files["prompt"][turn_id], 'r') as f:
                 text += "\nUser: " + f.read()
-            try:
-                with open(f"dialogue/{key}-response.txt", 'r') as f:
-                    text += "\nAI: " + f.read()
-            except:
-                text += "\nAI: <no response>"
+            with open(files["response"][turn_id], 'r') as f:
+                text += "\nAI: " + f.read()
         summary = send_summary_request_to_openai(text, recent_summary)
-        save_summary(summary)
-        # Move processed files to history directory
-        move_files_to_history(prompts[:5])
-        move_files_to_history(responses[:5])
+
+        # Move processed files to history directory, contexts included
+        summarized = [files[kind][turn_id] for turn_id in turns[:5]
+                      for kind in ("prompt", "response", "context") if turn_id in files.get(kind, {})]
+        # Git snapshots (conductor -g) go with their turn
+        snapshots = [os.path.join(DIALOGUE_DIR, f"{turn_id}-snapshot.json") for turn_id in turns[:5]]
+        summarized += [path for path in snapshots if os.path.exists(path)]
+        with session.lock_dir(DIALOGUE_DIR):
+            if not all(os.path.exists(f) for f in summarized):
+                print("These turns were already summarized by another run")
+                return
+            save_summary(summary)
+            move_files_to_history(summarized)
+        compact_history()
 
 def main():
-    Path(DIALOGUE_DIR).mkdir(exist_ok=True)
+    parser = argparse.ArgumentParser(description="Summarize the oldest turns and move them to the history")
+    parser.add_argument("-S", "--session", help="Named session to summarize")
+    args = parser.parse_args()
+    use_session(args.session)
+    Path(DIALOGUE_DIR).mkdir(parents=True, exist_ok=True)
     summarize_conversation()
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+import os
+import json
+import glob
+import tempfile
+import subprocess
+
+import conductor
+import metrics
+import reader
+import session
+from watch import is_hidden
+
+# Every diff turn of a chain is resent with each later turn. Once the diffs
+# of a chain add up to more than this share of its full context, a fresh
+# full snapshot is cheaper, and it bounds the history at (1 + ratio) times
+# the size of the full context.
+MAX_DIFF_RATIO = 0.5
+
+def git(*args, env=None, check=True, input=None):
+    result = subprocess.run(["git", *args], capture_output=True, text=True, env=env, input=input)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result.stdout
+
+def is_git_repo():
+    return subprocess.run(["git", "rev-parse", "--is-inside-work-tree"],
+                          capture_output=True, text=True).returncode == 0
+
+def object_exists(name):
+    return subprocess.run(["git", "cat-file", "-e", name], capture_output=True).returncode == 0
+
+def head_commit():
+    return git("rev-parse", "--verify", "-q", "HEAD", check=False).strip() or None
+
+def snapshot_files(exclusions, max_size=reader.MAX_FILE_SIZE):
+    """
+    The files whose contents the context would send. Excluded paths, binaries
+    and oversized files are left out, so they are never copied into
+    .git/objects.
+    """
+    files = []
+    for path in conductor.context_files(exclusions):
+        if os.path.splitext(path)[1].lower() in reader.BINARY_EXTENSIONS:
+            continue
+        if max_size and os.path.getsize(path) > max_size:
+            continue
+        files.append(path)
+    return files
+
+def working_tree_hash(files):
+    """
+    Hash of the given files as they are right now, committed or not. Uses a
+    throwaway index, so the user's staging area is left alone.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp, "index"))
+        git("update-index", "--add", "-z", "--stdin", env=env, input="".join(f"{path}\0" for path in files))
+        return git("write-tree", env=env).strip()
+
+def snapshot_path(epoch_time):
+    return os.path.join(conductor.DIALOGUE_DIR, f"{epoch_time}-snapshot.json")
+
+def load_snapshots():
+    """Snapshot records of the turns still in DIALOGUE_DIR, oldest first"""
+    snapshots = []
+    for path in glob.glob(os.path.join(conductor.DIALOGUE_DIR, "*-snapshot.json")):
+        with open(path, 'r') as f:
+            snapshots.append(json.load(f))
+    return sorted(snapshots, key=lambda s: int(s["epoch"]))
+
+def save_snapshot(epoch_time, snapshot):
+    """Record the tree a turn's context was built from; a full turn starts a new chain"""
+    snapshot = {key: value for key, value in snapshot.items() if key not in ("changed", "chain")}
+    snapshot["epoch"] = epoch_time
+    if snapshot["mode"] == "full":
+        snapshot["base"] = epoch_time
+    session.atomic_write(snapshot_path(epoch_time), json.dumps(snapshot, indent=2))
+    return snapshot
+
+def turn_is_complete(epoch_time):
+    """Whether the turn's prompt, context and response are all still in DIALOGUE_DIR"""
+    return all(os.path.exists(os.path.join(conductor.DIALOGUE_DIR, f"{epoch_time}-{kind}.txt"))
+               for kind in ("prompt", "context", "response"))
+
+def current_chain():
+    """
+    Epochs of the turns the next diff would build on: the last full snapshot
+    and every diff turn since. Empty if any of them was summarized away or
+    never got a response, since the model would then be missing context.
+    """
+    snapshots = load_snapshots()
+    if not snapshots:
+        return [], None
+    last = snapshots[-1]
+    chain = [s for s in snapshots if s["base"] == last["base"]]
+    if chain[0]["epoch"] != last["base"] or not all(turn_is_complete(s["epoch"]) for s in chain):
+        return [], None
+    return [s["epoch"] for s in chain], last
+
+def take_snapshot(exclusions, max_size=reader.MAX_FILE_SIZE):
+    """
+    Decide how the next turn sends its context. Returns a snapshot record with
+    mode "diff" (and the previous tree to diff against) when an intact chain
+    exists and it stays small with this change, otherwise mode "full". Its
+    "chain" lists the turns the message history must carry the context of.
+    """
+    with metrics.phase("git"):
+        tree = working_tree_hash(snapshot_files(exclusions, max_size))
+        snapshot = {"tree": tree, "commit": head_commit(), "mode": "full", "base": None, "previous": None, "chain": []}
+
+        chain, last = current_chain()
+        if not chain:
+            return snapshot
+        if not object_exists(last["tree"]):
+            # Garbage collected since, nothing to diff against
+            return snapshot
+
+        changed = changed_files(last["tree"], tree, exclusions)
+        full_size = os.path.getsize(os.path.join(conductor.DIALOGUE_DIR, f"{last['base']}-context.txt"))
+        changed_size = sum(os.path.getsize(path) for status, path in changed if os.path.isfile(path))
+        chain_size = sum(os.path.getsize(os.path.join(conductor.DIALOGUE_DIR, f"{epoch}-context.txt"))
+                         for epoch in chain[1:])
+        if chain_size + changed_size > MAX_DIFF_RATIO * full_size:
+            return snapshot
+
+        snapshot.update(mode="diff", base=last["base"], previous=last["tree"], changed=changed, chain=chain)
+        return snapshot
+
+def changed_files(old_tree, new_tree, exclusions):
+    """(status, path) pairs between two trees, without excluded paths"""
+    is_excluded = conductor.exclusion_filter(exclusions)
+    changed = []
+    # --relative keeps paths relative to the cwd, like the ones in the full context
+    for line in git("diff", "--name-status", "--no-renames", "--relative", old_tree, new_tree).splitlines():
+        status, path = line.split("\t", 1)
+        # glob("**/*") never picks up dotfiles, so the full context has none either
+        if not is_hidden(path) and not is_excluded(path):
+            changed.append((status, path))
+    return changed
+
+def iter_changes(snapshot, exclusions, max_size=reader.MAX_FILE_SIZE):
+    """
+    Yield the context of a diff turn: a compact unified diff against the
+    previous turn's tree, then the full contents of every touched file.
+    """
+    changed = snapshot["changed"]
+    if not changed:
+        yield "No files changed since the last turn.\n"
+        return
+
+    yield f"Changes since the last turn ({len(changed)} files):\n"
+    yield "".join(f"{status}\t{path}\n" for status, path in changed)
+
+    # Added files are sent whole below and deleted ones are listed above,
+    # so only modifications are worth a diff
+    modified = [path for status, path in changed if status == "M"]
+    if modified:
+        yield "\n"
+        yield git("diff", "--no-color", "--no-renames", "--relative", "-U1",
+                  snapshot["previous"], snapshot["tree"], "--", *modified)
+
+    present = [path for status, path in changed if status != "D"]
+    for path, (content, _) in reader.iter_loaded(present, lambda path: reader.load(path, max_size)):
+        yield f"\n\n# Content of {path}:\n"
+        yield content
+
+def gather_message_history(chain):
+    """
+    Message history in which every turn of the chain carries its context.
+    chain comes from take_snapshot, so it is read before this turn's snapshot
+    is saved.
+    """
+    return conductor.gather_message_history(context_epochs=set(chain))
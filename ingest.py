@@ -0,0 +1,169 @@
+import os
+import re
+import zlib
+import random
+import hashlib
+from typing import List, TYPE_CHECKING
+
+import archive
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+# Near-duplicate detection: MinHash signatures over word shingles, bucketed
+# with LSH. Two chunks whose estimated Jaccard similarity reaches the
+# threshold are treated as one.
+NUM_PERMUTATIONS = 64
+BANDS = 16
+SHINGLE_SIZE = 5
+NEAR_DUPLICATE_THRESHOLD = 0.85
+MERSENNE_PRIME = (1 << 61) - 1
+
+DOCUMENT_TYPES = ("prompt", "response", "summary", "context")
+SECTION_HEADER = re.compile(r'^\n*# (?:Content|Outline) of (.+?)(?: \(bodies omitted\))?:\n')
+
+# File extensions chunked along their syntax rather than by character count
+LANGUAGES = {
+    ".py": "python", ".js": "js", ".jsx": "js", ".mjs": "js", ".ts": "ts", ".tsx": "ts",
+    ".go": "go", ".rs": "rust", ".java": "java", ".kt": "kotlin", ".c": "c", ".h": "c",
+    ".cc": "cpp", ".cpp": "cpp", ".hpp": "cpp", ".cs": "csharp", ".rb": "ruby",
+    ".php": "php", ".swift": "swift", ".scala": "scala", ".md": "markdown", ".html": "html",
+}
+
+_rng = random.Random(0)
+PERMUTATIONS = [(_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+                for _ in range(NUM_PERMUTATIONS)]
+
+def normalize(text):
+    return " ".join(text.split())
+
+def content_hash(text):
+    return hashlib.sha1(normalize(text).encode('utf-8')).hexdigest()
+
+def minhash(text):
+    words = normalize(text).lower().split()
+    shingles = {zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode('utf-8'))
+                for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    return tuple(min((a * s + b) % MERSENNE_PRIME for s in shingles) for a, b in PERMUTATIONS)
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+class ChunkStore:
+    """Unique chunks with back-references to every turn and document type they appeared in"""
+
+    def __init__(self):
+        self.chunks = []
+        self.by_hash = {}
+        self.buckets = {}
+        self.rows = NUM_PERMUTATIONS // BANDS
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _find_similar(self, signature):
+        candidates = set()
+        for band in range(BANDS):
+            key = (band, signature[band * self.rows:(band + 1) * self.rows])
+            candidates.update(self.buckets.get(key, ()))
+        best = None
+        for index in candidates:
+            score = similarity(signature, self.chunks[index]["signature"])
+            if score >= NEAR_DUPLICATE_THRESHOLD and (best is None or score > best[0]):
+                best = (score, index)
+        return best[1] if best else None
+
+    def add(self, text, metadata):
+        digest = content_hash(text)
+        index = self.by_hash.get(digest)
+        if index is not None:
+            self.exact_duplicates += 1
+        else:
+            signature = minhash(text)
+            index = self._find_similar(signature)
+            if index is not None:
+                self.near_duplicates += 1
+                self.by_hash[digest] = index
+            else:
+                index = len(self.chunks)
+                self.chunks.append({"text": text, "signature": signature, "metadata": dict(metadata),
+                                    "sources": [], "types": []})
+                self.by_hash[digest] = index
+                for band in range(BANDS):
+                    key = (band, signature[band * self.rows:(band + 1) * self.rows])
+                    self.buckets.setdefault(key, []).append(index)
+
+        chunk = self.chunks[index]
+        if metadata["source"] not in chunk["sources"]:
+            chunk["sources"].append(metadata["source"])
+        # A chunk shared by e.g. a prompt and a context must be found under both types
+        doc_type = metadata.get("type", "unknown")
+        if doc_type not in chunk["types"]:
+            chunk["types"].append(doc_type)
+
+    def documents(self):
+        from langchain_core.documents import Document
+        documents = []
+        for chunk in self.chunks:
+            metadata = dict(chunk["metadata"])
+            metadata["sources"] = chunk["sources"]
+            metadata["occurrences"] = len(chunk["sources"])
+            metadata["types"] = chunk["types"]
+            documents.append(Document(page_content=chunk["text"], metadata=metadata))
+        return documents
+
+def _splitter(language=None):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter, Language
+    if language:
+        return RecursiveCharacterTextSplitter.from_language(
+            Language(language), chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+def context_sections(text):
+    """(file path or None for the directory listing, section body) pairs of a context dump"""
+    for block in archive.split_blocks(text):
+        match = SECTION_HEADER.match(block)
+        if match:
+            yield match.group(1), block[match.end():]
+        else:
+            yield None, block
+
+def build_chunks(documents: List["Document"]) -> List["Document"]:
+    """
+    Chunk documents by type and collapse duplicates. Prompts, responses and
+    summaries are split as prose; contexts are split into their file sections
+    first, and code is split along its syntax. Identical and near-identical
+    chunks are stored once, listing every source they appeared in.
+    """
+    splitters = {}
+
+    def split(text, language=None):
+        if language not in splitters:
+            try:
+                splitters[language] = _splitter(language)
+            except ValueError:
+                # Language not known to this langchain version
+                splitters[language] = splitters.get(None) or _splitter()
+        return splitters[language].split_text(text)
+
+    store = ChunkStore()
+    for doc in documents:
+        doc_type = doc.metadata.get("type", "unknown")
+        base = dict(doc.metadata)
+
+        if doc_type == "context":
+            for path, body in context_sections(doc.page_content):
+                language = LANGUAGES.get(os.path.splitext(path)[1]) if path else None
+                header = f"# {path}\n" if path else "# Directory Structure\n"
+                for chunk in split(body, language):
+                    store.add(header + chunk, dict(base, file=path))
+        else:
+            for chunk in split(doc.page_content):
+                store.add(chunk, base)
+
+    chunks = store.documents()
+    print(f"Ingested {len(chunks)} unique chunks "
+          f"({store.exact_duplicates} exact and {store.near_duplicates} near duplicates collapsed)")
+    return chunks
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+TRACE_DIR = "traces/"
+
+# Upper bounds in seconds, suited to anything from a file read to an LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class Registry:
+    """Counters and histograms rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, hist in series.items():
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {hist.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist.total}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+class Trace:
+    """Wall-clock timings of the phases of one run, written out as JSON"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.spans.append({
+                    "name": name,
+                    "start": round(start - self.origin, 6),
+                    "duration": round(end - start, 6),
+                    "thread": threading.current_thread().name
+                })
+
+    def record(self, name, duration):
+        """Add a span for time measured by the caller, e.g. summed across a generator"""
+        with self.lock:
+            self.spans.append({
+                "name": name,
+                "start": None,
+                "duration": round(duration, 6),
+                "thread": threading.current_thread().name
+            })
+
+    def set(self, **attributes):
+        with self.lock:
+            self.attributes.update(attributes)
+
+    def totals(self):
+        """Summed duration per phase name, for phases that run more than once"""
+        totals = {}
+        for span in self.spans:
+            totals[span["name"]] = round(totals.get(span["name"], 0) + span["duration"], 6)
+        return totals
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "started": self.started,
+            "total": round(time.perf_counter() - self.origin, 6),
+            "phases": self.totals(),
+            "spans": self.spans,
+            "attributes": self.attributes
+        }
+
+    def write(self, path=None):
+        path = path or os.path.join(TRACE_DIR, f"{self.run_id}-trace.json")
+        Path(os.path.dirname(path) or ".").mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+# The trace of the current conductor run. Phases are always timed; whether
+# the trace is written to disk is up to the caller.
+_trace = Trace("0")
+
+def start_trace(run_id):
+    global _trace
+    _trace = Trace(run_id)
+    return _trace
+
+def current_trace():
+    return _trace
+
+def phase(name):
+    """Time a block of code as a phase of the current trace"""
+    return _trace.phase(name)
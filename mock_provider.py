@@ -0,0 +1,38 @@
+import json
+import time
+
+# Simulated upstream latency in seconds, set by benchmarks and tests
+LATENCY = 0.0
+
+def last_user_text(messages):
+    """Text of the most recent user message"""
+    for msg in reversed(messages):
+        if msg.get("role") != "user":
+            continue
+        content = msg.get("content", "")
+        if isinstance(content, str):
+            return content
+        texts = [part.get("text", "") for part in content if part.get("type") == "text"]
+        if texts:
+            return "\n".join(texts)
+    return ""
+
+def mock_completion(messages, model="mock"):
+    """
+    Deterministic stand-in for an LLM, returning (content, tokens used).
+
+    The reply follows the JSON response format from preamble.txt so that
+    save_response_components exercises the same code path as a real reply.
+    """
+    if LATENCY:
+        time.sleep(LATENCY)
+    prompt = last_user_text(messages)
+    first_line = next((line for line in prompt.splitlines() if line.strip()), "")
+    reply = {
+        "text": f"Mock response from {model} to: {first_line[:200]}",
+        "patch": "",
+        "commands": []
+    }
+    content = f"```json\n{json.dumps(reply, indent=2)}\n```"
+    prompt_chars = sum(len(str(msg.get("content", ""))) for msg in messages)
+    return content, (prompt_chars + len(content)) // 4
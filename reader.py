@@ -0,0 +1,104 @@
+import os
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_FILE_SIZE = 1 << 20  # Larger files are left out of the context
+MMAP_THRESHOLD = 256 << 10  # Text files from this size on are read through mmap
+SNIFF_SIZE = 8192  # Bytes looked at to tell text from binary
+READ_WORKERS = 8
+
+# Never worth opening: the extension alone says the file is not text
+BINARY_EXTENSIONS = {
+    ".png": "PNG image", ".jpg": "JPEG image", ".jpeg": "JPEG image", ".gif": "GIF image",
+    ".webp": "WebP image", ".ico": "icon", ".bmp": "bitmap image", ".tif": "TIFF image", ".tiff": "TIFF image",
+    ".pdf": "PDF document", ".zip": "zip archive", ".gz": "gzip archive", ".tgz": "gzip archive",
+    ".bz2": "bzip2 archive", ".xz": "xz archive", ".zst": "zstd archive", ".7z": "7z archive", ".tar": "tar archive",
+    ".sqlite": "SQLite database", ".sqlite3": "SQLite database", ".db": "database",
+    ".faiss": "FAISS index", ".pkl": "pickle", ".pickle": "pickle", ".npy": "NumPy array", ".npz": "NumPy archive",
+    ".pt": "model weights", ".pth": "model weights", ".bin": "binary data", ".safetensors": "model weights",
+    ".onnx": "ONNX model", ".h5": "HDF5 data", ".parquet": "Parquet data", ".zdict": "zstd dictionary",
+    ".so": "shared library", ".dylib": "shared library", ".dll": "shared library", ".exe": "executable",
+    ".o": "object file", ".a": "static library", ".pyc": "Python bytecode", ".class": "Java class",
+    ".woff": "font", ".woff2": "font", ".ttf": "font", ".otf": "font",
+    ".mp3": "audio", ".wav": "audio", ".ogg": "audio", ".flac": "audio", ".mp4": "video", ".mov": "video", ".webm": "video",
+}
+
+MAGIC = [
+    (b"\x89PNG\r\n\x1a\n", "PNG image"),
+    (b"\xff\xd8\xff", "JPEG image"),
+    (b"GIF8", "GIF image"),
+    (b"%PDF", "PDF document"),
+    (b"PK\x03\x04", "zip archive"),
+    (b"\x1f\x8b", "gzip archive"),
+    (b"\x28\xb5\x2f\xfd", "zstd archive"),
+    (b"SQLite format 3\x00", "SQLite database"),
+    (b"\x7fELF", "executable"),
+    (b"\x80\x04\x95", "pickle"),
+    (b"\x93NUMPY", "NumPy array"),
+]
+
+def human_size(size):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def sniff(head, path=""):
+    """Kind of binary data head starts with, or None if it looks like text"""
+    kind = BINARY_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if kind:
+        return kind
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            return kind
+    if b"\x00" in head:
+        return "binary data"
+    return None
+
+def decode(data):
+    # Same result as reading in text mode with errors="ignore"
+    return str(data, 'utf-8', 'ignore').replace("\r\n", "\n").replace("\r", "\n")
+
+def load(path, max_size=MAX_FILE_SIZE):
+    """
+    Return (text, None) for a text file, or (placeholder, reason) for a file
+    left out of the context because it is binary or larger than max_size.
+    """
+    size = os.path.getsize(path)
+    kind = BINARY_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if kind:
+        return f"[{kind}, {human_size(size)}, not included]\n", "binary"
+    if max_size and size > max_size:
+        return f"[{human_size(size)} file, over the {human_size(max_size)} limit, not included]\n", "size"
+
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+        kind = sniff(head)
+        if kind:
+            return f"[{kind}, {human_size(size)}, not included]\n", "binary"
+        if len(head) < SNIFF_SIZE:
+            return decode(head), None
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return decode(data), None
+        return decode(head + f.read()), None
+
+def iter_loaded(paths, load_fn=load, workers=READ_WORKERS):
+    """
+    Yield (path, load_fn(path)) in order while up to `workers` files are read
+    ahead in parallel. At most twice that many results are held at once.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        paths = iter(paths)
+        for path in paths:
+            pending.append((path, pool.submit(load_fn, path)))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            path, future = pending.pop(0)
+            result = future.result()
+            for next_path in paths:
+                pending.append((next_path, pool.submit(load_fn, next_path)))
+                break
+            yield path, result
@@ -0,0 +1,242 @@
+import time
+import threading
+import itertools
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, Tuple
+
+# Priority lanes, highest first
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = [INTERACTIVE, BATCH]
+
+# Used when config.json has no entry for a provider/model
+DEFAULT_LIMITS = {"rpm": 50, "tpm": 200000}
+
+def estimate_tokens(messages, max_tokens=0):
+    """Cheap token estimate for a message list (roughly 4 characters per token)"""
+    chars = 0
+    for msg in messages:
+        content = msg.get("content", "")
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+                else:
+                    # Images are billed per tile, not per base64 character
+                    chars += 4 * 1600
+    return chars // 4 + max_tokens
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to `per_minute` units"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they already are)"""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def drain(self):
+        self.level = min(self.level, 0.0)
+
+class Ticket:
+    def __init__(self, ticket_id, key, client, lane, tokens):
+        self.id = ticket_id
+        self.key = key
+        self.client = client
+        self.lane = lane
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.initial_position = None
+
+    @property
+    def queue_wait(self):
+        end = self.started if self.started is not None else time.monotonic()
+        return end - self.enqueued
+
+class ModelQueue:
+    """Waiting tickets and rate buckets for one provider/model pair"""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # lane -> client -> deque of tickets, clients served round robin
+        self.lanes = {lane: OrderedDict() for lane in LANES}
+
+    def push(self, ticket):
+        clients = self.lanes[ticket.lane]
+        clients.setdefault(ticket.client, deque()).append(ticket)
+
+    def remove(self, ticket):
+        clients = self.lanes[ticket.lane]
+        waiting = clients.get(ticket.client)
+        if waiting is None:
+            return
+        if ticket in waiting:
+            waiting.remove(ticket)
+        if not waiting:
+            del clients[ticket.client]
+
+    def order(self):
+        """Tickets in the order they will be served"""
+        ordered = []
+        for lane in LANES:
+            queues = [list(q) for q in self.lanes[lane].values()]
+            for round_ in itertools.zip_longest(*queues):
+                ordered.extend(t for t in round_ if t is not None)
+        return ordered
+
+    def head(self):
+        for lane in LANES:
+            clients = self.lanes[lane]
+            if clients:
+                return next(iter(clients.values()))[0]
+        return None
+
+    def rotate(self, ticket):
+        """Move the ticket's client to the back of its lane after it is served"""
+        clients = self.lanes[ticket.lane]
+        if ticket.client in clients:
+            clients.move_to_end(ticket.client)
+
+class Scheduler:
+    """
+    Client-side rate limiter for upstream providers.
+
+    Each provider/model pair gets a request bucket (rpm) and a token bucket
+    (tpm). Callers block in `acquire` until both buckets have room; waiting
+    requests are served interactive lane first, and round robin between
+    clients inside a lane so one client's burst cannot starve the others.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, int]]] = None):
+        self.limits = limits or {}
+        self.queues: Dict[Tuple[str, str], ModelQueue] = {}
+        self.tickets: Dict[str, Ticket] = {}
+        self.counter = itertools.count(1)
+        self.cond = threading.Condition()
+
+    def _limits_for(self, provider, model):
+        limits = dict(DEFAULT_LIMITS)
+        limits.update(self.limits.get(provider, {}))
+        limits.update(self.limits.get(f"{provider}/{model}", {}))
+        return limits
+
+    def _queue(self, key):
+        if key not in self.queues:
+            limits = self._limits_for(*key)
+            self.queues[key] = ModelQueue(limits["rpm"], limits["tpm"])
+        return self.queues[key]
+
+    def acquire(self, provider, model, tokens, client="anonymous", lane=INTERACTIVE,
+                ticket_id=None, timeout=None) -> Ticket:
+        """Block until the request may be sent upstream and return its ticket"""
+        if lane not in LANES:
+            lane = INTERACTIVE
+        key = (provider, model)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            ticket_id = ticket_id or str(next(self.counter))
+            ticket = Ticket(ticket_id, key, client, lane, tokens)
+            queue = self._queue(key)
+            queue.push(ticket)
+            self.tickets[ticket_id] = ticket
+            ticket.initial_position = self._position(ticket)
+
+            try:
+                while True:
+                    now = time.monotonic()
+                    queue.requests.refill(now)
+                    queue.tokens.refill(now)
+                    wait = None
+                    if queue.head() is ticket:
+                        wait = max(queue.requests.wait_time(1), queue.tokens.wait_time(tokens))
+                        if wait == 0:
+                            break
+                    if deadline is not None:
+                        if now >= deadline:
+                            raise TimeoutError(f"Timed out waiting for {provider}/{model} capacity")
+                        wait = min(wait if wait is not None else deadline - now, deadline - now)
+                    self.cond.wait(wait)
+            except BaseException:
+                queue.remove(ticket)
+                self.tickets.pop(ticket_id, None)
+                self.cond.notify_all()
+                raise
+
+            queue.requests.consume(1)
+            queue.tokens.consume(tokens)
+            queue.remove(ticket)
+            queue.rotate(ticket)
+            ticket.started = time.monotonic()
+            self.cond.notify_all()
+            return ticket
+
+    def release(self, ticket: Ticket, actual_tokens=None, rate_limited=False):
+        """Reconcile the estimate with real usage once the upstream call is done"""
+        with self.cond:
+            queue = self._queue(ticket.key)
+            if actual_tokens is not None:
+                queue.tokens.level += ticket.tokens - actual_tokens
+            if rate_limited:
+                # The provider disagrees with our accounting, stop sending for a while
+                queue.requests.drain()
+                queue.tokens.drain()
+            self.tickets.pop(ticket.id, None)
+            self.cond.notify_all()
+
+    def _position(self, ticket):
+        order = self._queue(ticket.key).order()
+        return order.index(ticket) if ticket in order else 0
+
+    def position(self, ticket_id) -> Optional[Dict[str, Any]]:
+        """Queue status of a waiting or running request, None if unknown"""
+        with self.cond:
+            ticket = self.tickets.get(ticket_id)
+            if ticket is None:
+                return None
+            return {
+                "id": ticket.id,
+                "provider": ticket.key[0],
+                "model": ticket.key[1],
+                "lane": ticket.lane,
+                "client": ticket.client,
+                "state": "running" if ticket.started is not None else "queued",
+                "position": self._position(ticket) if ticket.started is None else 0,
+                "queue_wait": round(ticket.queue_wait, 3),
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Waiting requests and bucket levels for every provider/model"""
+        with self.cond:
+            now = time.monotonic()
+            result = {}
+            for (provider, model), queue in self.queues.items():
+                queue.requests.refill(now)
+                queue.tokens.refill(now)
+                result[f"{provider}/{model}"] = {
+                    "requests_available": int(queue.requests.level),
+                    "tokens_available": int(queue.tokens.level),
+                    "waiting": [
+                        {"id": t.id, "client": t.client, "lane": t.lane, "tokens": t.tokens}
+                        for t in queue.order()
+                    ],
+                }
+            return result
@@ -3,16 +3,18 @@ import os
 import sys
 import argparse
 from pathlib import Path
-import glob
 import json
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, TYPE_CHECKING
 
-# RAG components
-from langchain_community.embeddings import OpenAIEmbeddings, HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+import archive
+import ingest
+import session
+
+# RAG components are imported where they are used: langchain, FAISS and the
+# embedding backends take seconds to load.
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 def load_config():
     """Load API keys from config file"""
@@ -22,13 +24,17 @@ def load_config():
 def initialize_embeddings(config):
     """Initialize embeddings model based on available API keys"""
     if config.get("openai_api_key"):
+        from langchain_community.embeddings import OpenAIEmbeddings
         return OpenAIEmbeddings(api_key=config.get("openai_api_key"))
     else:
         # Fallback to local model that doesn't require API keys
+        from langchain_community.embeddings import HuggingFaceEmbeddings
         return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
 
-def load_documents(history_dir: str) -> List[Document]:
+def load_documents(history_dir: str) -> List["Document"]:
     """Load all text files from history directory"""
+    from langchain_core.documents import Document
+
     documents = []
     history_path = Path(history_dir)
     
@@ -36,16 +42,10 @@ def load_documents(history_dir: str) -> List[Document]:
         print(f"Error: Directory '{history_dir}' does not exist")
         sys.exit(1)
     
-    # Find all text files recursively
-    file_paths = glob.glob(os.path.join(history_dir, "**/*.txt"), recursive=True)
-    
-    for file_path in file_paths:
+    # Loose text files and turns packed into the compressed archive
+    for file_path, filename, content in archive.iter_documents(history_dir):
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                
             # Extract metadata from filename
-            filename = os.path.basename(file_path)
             file_type = "unknown"
             timestamp = None
             
@@ -53,7 +53,7 @@ def load_documents(history_dir: str) -> List[Document]:
             parts = filename.split('-')
             if len(parts) >= 2 and parts[0].isdigit():
                 try:
-                    timestamp = datetime.fromtimestamp(int(parts[0]))
+                    timestamp = datetime.fromtimestamp(session.id_time(parts[0]))
                     file_type = parts[1].split('.')[0]  # prompt, response, etc.
                 except:
                     pass
@@ -75,11 +75,9 @@ def load_documents(history_dir: str) -> List[Document]:
     print(f"Loaded {len(documents)} documents from {history_dir}")
     return documents
 
-def create_or_load_index(documents: List[Document], embeddings, index_name: str = "history_index"):
+def create_or_load_index(documents: List["Document"], embeddings, index_name: str = "history_index"):
     """Create or load vector index"""
-    # Create chunks for better retrieval
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = text_splitter.split_documents(documents)
+    from langchain_community.vectorstores import FAISS
     
     # Check if index already exists
     if os.path.exists(index_name) and os.path.isdir(index_name):
@@ -91,6 +89,10 @@ def create_or_load_index(documents: List[Document], embeddings, index_name: str
             print(f"Error loading index: {e}")
             print("Creating new index...")
     
+    # Create chunks for better retrieval, each unique chunk only once. Only
+    # needed here: MinHashing the whole history is too slow for every search
+    chunks = ingest.build_chunks(documents)
+    
     # Create new index
     print(f"Creating new index with {len(chunks)} chunks")
     vector_db = FAISS.from_documents(chunks, embeddings)
@@ -99,12 +101,16 @@ def create_or_load_index(documents: List[Document], embeddings, index_name: str
     vector_db.save_local(index_name)
     return vector_db
 
-def search_documents(query: str, vector_db, k: int = 5) -> List[Document]:
-    """Search for relevant documents"""
+def search_documents(query: str, vector_db, k: int = 5, doc_type: str = None) -> List["Document"]:
+    """Search for relevant documents, optionally only of one type (prompt, response, ...)"""
+    if doc_type:
+        # Collapsed chunks list every type they appeared as; older indexes only have "type"
+        return vector_db.similarity_search(
+            query, k=k, filter=lambda metadata: doc_type in metadata.get("types", [metadata.get("type")]))
     results = vector_db.similarity_search(query, k=k)
     return results
 
-def format_results(results: List[Document]) -> str:
+def format_results(results: List["Document"]) -> str:
     """Format search results for display"""
     output = []
     
@@ -112,7 +118,7 @@ def format_results(results: List[Document]) -> str:
         metadata = doc.metadata
         source = metadata.get("source", "Unknown source")
         timestamp = metadata.get("timestamp")
-        doc_type = metadata.get("type", "unknown")
+        doc_type = ", ".join(metadata.get("types") or [metadata.get("type", "unknown")])
         
         # Format timestamp if available
         time_str = ""
@@ -121,6 +127,10 @@ def format_results(results: List[Document]) -> str:
         
         # Prepare header
         header = f"\n[{i+1}] {source}{time_str} - Type: {doc_type}"
+        if metadata.get("file"):
+            header += f" - File: {metadata['file']}"
+        if metadata.get("occurrences", 1) > 1:
+            header += f" - Seen in {metadata['occurrences']} turns"
         output.append(header)
         output.append("-" * len(header))
         
@@ -138,6 +148,7 @@ def main():
     parser.add_argument("--dir", default="dialogue", help="Directory containing history documents")
     parser.add_argument("--rebuild", action="store_true", help="Force rebuild of the search index")
     parser.add_argument("--results", type=int, default=5, help="Number of results to return")
+    parser.add_argument("--type", choices=ingest.DOCUMENT_TYPES, help="Only search prompts, responses, summaries or contexts")
     args = parser.parse_args()
     
     # Initialize
@@ -157,7 +168,7 @@ def main():
     vector_db = create_or_load_index(documents, embeddings, index_name)
     
     # Search for relevant documents
-    results = search_documents(args.query, vector_db, k=args.results)
+    results = search_documents(args.query, vector_db, k=args.results, doc_type=args.type)
     
     # Format and print results
     if results:
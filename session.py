@@ -0,0 +1,108 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform; runs are then only safe one at a time
+    fcntl = None
+
+DIALOGUE_ROOT = "dialogue/"
+HISTORY_ROOT = "history/"
+COUNTER_FILE = ".last-id"
+LOCK_FILE = ".lock"
+SESSION_NAME = re.compile(r'^[\w.-]+$')
+TURN_FILE = re.compile(r'(\d+)-(\w+)\.txt$')
+
+def session_dirs(name=None):
+    """(dialogue directory, history directory) of a named session, or of the default one"""
+    if not name:
+        return DIALOGUE_ROOT, HISTORY_ROOT
+    if not SESSION_NAME.match(name) or name.startswith('.'):
+        raise ValueError(f"Invalid session name: {name!r}")
+    return os.path.join(DIALOGUE_ROOT, name) + "/", os.path.join(HISTORY_ROOT, name) + "/"
+
+@contextmanager
+def locked(path, exclusive=True):
+    """Hold an advisory lock on path (created if missing) for the duration of the block"""
+    Path(os.path.dirname(path) or ".").mkdir(parents=True, exist_ok=True)
+    with open(path, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def lock_dir(directory, exclusive=True):
+    """
+    Lock a dialogue or history directory. Anything that moves or deletes files
+    in it takes the lock exclusively, readers take it shared.
+    """
+    return locked(os.path.join(directory, LOCK_FILE), exclusive)
+
+def next_id():
+    """
+    Return a new turn id: the current time in milliseconds, or one more than
+    the last id handed out if that is not smaller. The counter is shared by
+    every session and process, so ids never collide and always sort in the
+    order they were issued. Ids stay digits only, so older second-based ids
+    sort before them.
+    """
+    with locked(os.path.join(DIALOGUE_ROOT, COUNTER_FILE)) as f:
+        f.seek(0)
+        last = int(f.read().strip() or 0)
+        turn_id = max(int(time.time() * 1000), last + 1)
+        f.seek(0)
+        f.truncate()
+        f.write(str(turn_id))
+        f.flush()
+    return str(turn_id)
+
+def id_time(turn_id):
+    """Unix time a turn id was issued at; accepts second and millisecond ids"""
+    turn_id = int(turn_id)
+    return turn_id / 1000 if turn_id >= 10 ** 11 else turn_id
+
+def parse_name(name):
+    """(turn id, kind) from names like 1712345678901-response.txt, or (None, None)"""
+    match = TURN_FILE.match(os.path.basename(name))
+    if match:
+        return match.group(1), match.group(2)
+    return None, None
+
+def turn_files(directory):
+    """{kind: {turn id: path}} for the turn files in a dialogue directory"""
+    files = {}
+    for path in Path(directory).glob("*.txt"):
+        turn_id, kind = parse_name(path.name)
+        if turn_id:
+            files.setdefault(kind, {})[turn_id] = str(path)
+    return files
+
+def complete_turns(files):
+    """Ids of the turns that have both a prompt and a response, oldest first"""
+    prompts = files.get("prompt", {})
+    responses = files.get("response", {})
+    return sorted(prompts.keys() & responses.keys(), key=int)
+
+def atomic_write(path, content):
+    """
+    Write content (a string or an iterable of chunks) to a temporary file and
+    move it into place, so readers see either nothing or the whole file.
+    """
+    if isinstance(content, str):
+        content = [content]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            for chunk in content:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,207 @@
+import os
+import re
+import ast
+import json
+import hashlib
+import tempfile
+import fnmatch
+import threading
+from pathlib import Path
+
+import reader
+
+CACHE_DIR = ".skeleton_cache/"
+PIN_FILE = "pin.txt"
+# Bump when the outline format changes so stale cache entries are ignored
+SKELETON_VERSION = "1"
+
+MAX_LINE = 160
+
+SOURCE_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".mjs", ".go", ".rs", ".java", ".kt",
+    ".c", ".h", ".cc", ".cpp", ".hpp", ".cs", ".rb", ".php", ".swift", ".scala", ".sh"
+}
+
+# Lines that declare something in most C-like and scripting languages
+DECLARATION = re.compile(
+    r'^\s*(?:export\s+)?(?:default\s+)?(?:pub(?:\([\w:]+\))?\s+)?(?:async\s+)?'
+    r'(?:def|class|function|func|fn|struct|enum|trait|impl|interface|type|module|package|'
+    r'import|from|use|require|#include|#define|namespace|public|private|protected|static|'
+    r'const\s+\w+\s*=\s*(?:async\s*)?(?:\(|function))\b'
+)
+COMMENT = re.compile(r'^\s*(?://|#|/\*|\*|--)')
+SYMBOL = re.compile(r'\b(?:def|class|function|func|fn|struct|enum|trait|interface|type)\s+(\w+)')
+WORD = re.compile(r'\w+')
+
+def load_pins():
+    """Patterns of files that are always sent in full, one per line like exclude.txt"""
+    if os.path.exists(PIN_FILE):
+        with open(PIN_FILE, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+    return []
+
+def shorten(line):
+    return line if len(line) <= MAX_LINE else line[:MAX_LINE - 3] + "..."
+
+def docstring_lines(doc, indent):
+    doc = doc.strip()
+    if "\n" not in doc:
+        return [f'{indent}"""{doc}"""']
+    lines = [f'{indent}"""']
+    lines.extend(f"{indent}{line}".rstrip() for line in doc.splitlines())
+    lines.append(f'{indent}"""')
+    return lines
+
+def outline_function(node, indent):
+    lines = [f"{indent}@{ast.unparse(d)}" for d in node.decorator_list]
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    lines.append(shorten(f"{indent}{prefix} {node.name}({ast.unparse(node.args)}){returns}:"))
+    doc = ast.get_docstring(node)
+    if doc:
+        lines.extend(docstring_lines(doc, indent + "    "))
+    lines.append(f"{indent}    ...")
+    return lines
+
+def outline_class(node, indent):
+    lines = [f"{indent}@{ast.unparse(d)}" for d in node.decorator_list]
+    bases = [ast.unparse(b) for b in node.bases] + [ast.unparse(k) for k in node.keywords]
+    lines.append(f"{indent}class {node.name}({', '.join(bases)}):" if bases else f"{indent}class {node.name}:")
+    doc = ast.get_docstring(node)
+    if doc:
+        lines.extend(docstring_lines(doc, indent + "    "))
+    members = []
+    for child in node.body:
+        members.extend(outline_node(child, indent + "    "))
+    lines.extend(members or [f"{indent}    ..."])
+    return lines
+
+def outline_node(node, indent):
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [indent + ast.unparse(node)]
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return outline_function(node, indent)
+    if isinstance(node, ast.ClassDef):
+        return outline_class(node, indent)
+    if isinstance(node, (ast.Assign, ast.AnnAssign)):
+        # Constants and class attributes, values trimmed to one short line
+        source = ast.unparse(node)
+        return [shorten(indent + source.splitlines()[0])]
+    if isinstance(node, ast.If) and "__name__" in ast.unparse(node.test):
+        return [f"{indent}if {ast.unparse(node.test)}:", f"{indent}    ..."]
+    if isinstance(node, ast.Try):
+        # Usually an optional import guard; keep the imports it tries
+        return [line for child in node.body for line in outline_node(child, indent)
+                if line.lstrip().startswith(("import", "from"))]
+    return []
+
+def outline_python(source):
+    """Module docstring, imports, constants and signatures with their docstrings"""
+    tree = ast.parse(source)
+    lines = []
+    doc = ast.get_docstring(tree)
+    if doc:
+        lines.extend(docstring_lines(doc, ""))
+    for node in tree.body:
+        lines.extend(outline_node(node, ""))
+    return "\n".join(lines) + "\n"
+
+def outline_generic(source):
+    """Leading comment block plus every line that looks like a declaration"""
+    lines = []
+    body = source.splitlines()
+    for line in body:
+        if not COMMENT.match(line):
+            break
+        lines.append(shorten(line.rstrip()))
+    for line in body[len(lines):]:
+        if DECLARATION.match(line):
+            lines.append(shorten(line.rstrip()))
+    return "\n".join(lines) + "\n"
+
+def symbols_python(source):
+    return sorted({node.name for node in ast.walk(ast.parse(source))
+                   if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))})
+
+def render(path, source):
+    """Return (outline, defined symbol names) for a source file"""
+    if path.endswith(".py"):
+        try:
+            return outline_python(source), symbols_python(source)
+        except (SyntaxError, ValueError):
+            pass
+    return outline_generic(source), sorted(set(SYMBOL.findall(source)))
+
+def cached_render(path, source):
+    """render(), cached on disk by content hash so unchanged files cost one read"""
+    digest = hashlib.sha1(f"{SKELETON_VERSION}:{os.path.splitext(path)[1]}:".encode('utf-8') + source.encode('utf-8')).hexdigest()
+    cache_file = os.path.join(CACHE_DIR, digest[:2], f"{digest}.json")
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                entry = json.load(f)
+            return entry["skeleton"], entry["symbols"]
+        except (OSError, ValueError, KeyError):
+            pass
+    skeleton, symbols = render(path, source)
+    Path(os.path.dirname(cache_file)).mkdir(parents=True, exist_ok=True)
+    # Unique per call: reader threads may render files with identical content at once
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump({"skeleton": skeleton, "symbols": symbols}, f)
+    os.replace(tmp_file, cache_file)
+    return skeleton, symbols
+
+class Outliner:
+    """
+    Decides per file whether the prompt needs its full body. A source file is
+    kept in full when it is pinned, or when the prompt mentions its path, its
+    name or any class/function it defines; every other source file is replaced
+    by its skeleton.
+    """
+
+    def __init__(self, prompt, pins=(), max_size=reader.MAX_FILE_SIZE):
+        self.prompt = prompt.lower()
+        self.max_size = max_size
+        self.words = set(WORD.findall(self.prompt))
+        # Case kept, so short symbols only match when written exactly
+        self.names = set(WORD.findall(prompt))
+        self.pins = list(pins)
+        self.outlined = 0
+        # Called from the context reader's worker threads
+        self.lock = threading.Lock()
+
+    def is_pinned(self, path):
+        return any(fnmatch.fnmatch(path, pattern) or path.startswith(pattern.rstrip('/') + '/')
+                   for pattern in self.pins)
+
+    def is_relevant(self, path, symbols):
+        lowered = path.lower()
+        stem = os.path.splitext(os.path.basename(lowered))[0]
+        if lowered in self.prompt or os.path.basename(lowered) in self.prompt:
+            return True
+        if len(stem) >= 3 and stem in self.words:
+            return True
+        return any(name in self.names or (len(name) >= 4 and name.lower() in self.words)
+                   for name in symbols)
+
+    def __call__(self, path, full_path):
+        """Return the skeleton to send instead of the file, or None to send it in full"""
+        if os.path.splitext(path)[1] not in SOURCE_EXTENSIONS or self.is_pinned(path):
+            return None
+        # Oversized and binary files (e.g. minified bundles) are left to the
+        # reader, which replaces them by a note without reading them in full
+        if self.max_size and os.path.getsize(full_path) > self.max_size:
+            return None
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        if reader.sniff(data[:reader.SNIFF_SIZE]):
+            return None
+        source = reader.decode(data)
+        skeleton, symbols = cached_render(path, source)
+        if self.is_relevant(path, symbols) or not skeleton.strip():
+            # Empty outlines (e.g. an empty __init__.py) are sent as they are
+            return None
+        with self.lock:
+            self.outlined += 1
+        return skeleton
@@ -0,0 +1,385 @@
+import os
+import sys
+import glob
+import time
+import errno
+import select
+import socket
+import struct
+import argparse
+import itertools
+import ctypes
+import ctypes.util
+
+import conductor
+import metrics
+import reader
+
+SOCKET_FILE = ".reich.sock"
+POLL_INTERVAL = 1.0
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# IN_MODIFY is left out on purpose: files are only re-read once fully written
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+def is_hidden(path):
+    """glob("**/*") skips dotfiles and dot-directories, so the model does too"""
+    return any(part.startswith('.') for part in path.split(os.sep))
+
+class InotifyWatcher:
+    """Recursive directory watcher built on Linux inotify"""
+
+    def __init__(self, root, skip_dir):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.skip_dir = skip_dir
+        self.dirs = {}
+        self.add_tree("")
+
+    def fileno(self):
+        return self.fd
+
+    def add_tree(self, rel):
+        for dirpath, dirnames, _ in os.walk(os.path.join(self.root, rel)):
+            relpath = os.path.relpath(dirpath, self.root)
+            relpath = "" if relpath == "." else relpath
+            dirnames[:] = [d for d in dirnames if not self.skip_dir(os.path.join(relpath, d))]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd >= 0:
+                self.dirs[wd] = relpath
+
+    def read_changes(self):
+        """Return (changed relative paths, whether everything must be rescanned)"""
+        changed = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                base = self.dirs.get(wd)
+                if base is None:
+                    continue
+                path = os.path.join(base, os.fsdecode(name)) if name else base
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and not self.skip_dir(path):
+                    self.add_tree(path)
+                changed.add(path)
+        return changed, rescan
+
+class PollingWatcher:
+    """Fallback for platforms without inotify: compares mtimes every POLL_INTERVAL"""
+
+    def __init__(self, root, skip_dir):
+        self.root = root
+        self.skip_dir = skip_dir
+        self.mtimes = self.snapshot()
+
+    def fileno(self):
+        return None
+
+    def snapshot(self):
+        mtimes = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            relpath = os.path.relpath(dirpath, self.root)
+            relpath = "" if relpath == "." else relpath
+            dirnames[:] = [d for d in dirnames if not self.skip_dir(os.path.join(relpath, d))]
+            for name in filenames:
+                try:
+                    mtimes[os.path.join(relpath, name)] = os.stat(os.path.join(dirpath, name)).st_mtime_ns
+                except OSError:
+                    pass
+        return mtimes
+
+    def read_changes(self):
+        current = self.snapshot()
+        changed = {path for path in current.keys() | self.mtimes.keys()
+                   if current.get(path) != self.mtimes.get(path)}
+        self.mtimes = current
+        return changed, False
+
+class WorkingTree:
+    """
+    In-memory copy of everything a prompt needs: file contents, token
+    estimates, the `tree` listing and the message history, kept current from
+    file system events so a prompt can be sent without any preparation.
+    """
+
+    def __init__(self, root='.', max_size=reader.MAX_FILE_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self.dialogue_dir = os.path.normpath(conductor.DIALOGUE_DIR)
+        self.files = {}
+        self.tokens = {}
+        self.tree = None
+        self.history = None
+        self.load_settings()
+
+    def load_settings(self):
+        self.exclusions = conductor.load_exclusions()
+        self.is_excluded = conductor.exclusion_filter(self.exclusions)
+        self.preamble = conductor.load_preamble() if os.path.exists(conductor.PREAMBLE_FILE) else ""
+
+    def skip_dir(self, path):
+        """Directories not worth watching; dialogue/ is watched for the history"""
+        path = os.path.normpath(path)
+        if path == self.dialogue_dir or self.dialogue_dir.startswith(path + os.sep):
+            return False
+        return is_hidden(path) or self.is_excluded(path)
+
+    def in_context(self, path):
+        return not is_hidden(path) and not self.is_excluded(path)
+
+    def read(self, path):
+        full_path = os.path.join(self.root, path)
+        if not os.path.isfile(full_path) or not self.in_context(path):
+            self.files.pop(path, None)
+            self.tokens.pop(path, None)
+            return
+        content, _ = reader.load(full_path, self.max_size)
+        self.files[path] = content
+        self.tokens[path] = len(content) // 4
+
+    def scan(self):
+        self.files = {}
+        self.tokens = {}
+        paths = [path for path in glob.glob("**/*", root_dir=self.root, recursive=True)
+                 if os.path.isfile(os.path.join(self.root, path)) and self.in_context(path)]
+        load = lambda path: reader.load(os.path.join(self.root, path), self.max_size)
+        for path, (content, _) in reader.iter_loaded(paths, load):
+            self.files[path] = content
+            self.tokens[path] = len(content) // 4
+        self.tree = conductor.generate_directory_structure(self.root, conductor.EXCLUDE_FILE)
+        self.history = conductor.gather_message_history()
+
+    def update(self, changed, rescan=False):
+        settings = {os.path.normpath(conductor.EXCLUDE_FILE), os.path.normpath(conductor.PREAMBLE_FILE)}
+        if rescan or settings & {os.path.normpath(p) for p in changed}:
+            self.load_settings()
+            self.scan()
+            return
+
+        before = set(self.files)
+        for path in changed:
+            if path == self.dialogue_dir or path.startswith(self.dialogue_dir + os.sep):
+                # Lock and id counter files change on every read of the history
+                if not os.path.basename(path).startswith('.'):
+                    self.history = None
+                continue
+            if self.dialogue_dir.startswith(path + os.sep):
+                # dialogue/ itself when a named session lives below it
+                continue
+            full_path = os.path.join(self.root, path)
+            if os.path.isdir(full_path):
+                for sub in glob.glob("**/*", root_dir=full_path, recursive=True):
+                    self.read(os.path.join(path, sub))
+            elif os.path.exists(full_path):
+                self.read(path)
+            else:
+                # Deleted or moved away, possibly a whole directory
+                prefix = path + os.sep
+                for gone in [p for p in self.files if p == path or p.startswith(prefix)]:
+                    self.files.pop(gone)
+                    self.tokens.pop(gone)
+
+        if set(self.files) != before:
+            self.tree = conductor.generate_directory_structure(self.root, conductor.EXCLUDE_FILE)
+        if self.history is None:
+            self.history = conductor.gather_message_history()
+
+    def total_tokens(self):
+        return sum(self.tokens.values())
+
+    def iter_context(self):
+        """Same output as conductor.iter_context, served from memory"""
+        yield f"Directory Structure:\n{self.tree}"
+        for path, content in self.files.items():
+            yield f"\n\n# Content of {path}:\n"
+            yield content
+
+def run_prompt(tree, user_prompt, args):
+    trace = metrics.start_trace(conductor.get_epoch_time())
+    final_prompt = itertools.chain([f"{tree.preamble}\n\n{user_prompt}\n\n"], tree.iter_context())
+    with metrics.phase("save"):
+        epoch_time, prompt_file, context_file = conductor.save_prompt(user_prompt, final_context=final_prompt)
+    trace.run_id = epoch_time
+    try:
+        response_text = conductor.send_request_to_server(
+            prompt_file=context_file,
+            image_paths=args.images or [],
+            server_url=args.server,
+            provider=args.provider,
+            model=args.model,
+            message_history=tree.history
+        )
+        conductor.process_response(epoch_time, response_text)
+        return response_text
+    finally:
+        if args.trace:
+            print(f"Trace written to {trace.write()}")
+
+def socket_file(session_name=None):
+    """Each session has its own daemon and socket"""
+    return f".reich-{session_name}.sock" if session_name else SOCKET_FILE
+
+def open_socket(path):
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            raise RuntimeError(f"Another conductor is already watching this directory ({path})")
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Left behind by a daemon that did not shut down cleanly
+            os.unlink(path)
+        finally:
+            probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    return server
+
+def receive_prompt(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks).decode('utf-8')
+
+def prompt_stamp(path):
+    """Modification time and size of the prompt file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def read_prompt(path):
+    # Read directly: the prompt file need not be part of the context at all
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def serve(args):
+    """Entry point for `conductor --watch`"""
+    os.makedirs(conductor.DIALOGUE_DIR, exist_ok=True)
+    tree = WorkingTree('.', args.max_file_size)
+    try:
+        watcher = InotifyWatcher('.', tree.skip_dir)
+    except (OSError, AttributeError):
+        print("inotify is not available, polling for changes instead")
+        watcher = PollingWatcher('.', tree.skip_dir)
+
+    start = time.perf_counter()
+    tree.scan()
+    print(f"Watching {len(tree.files)} files (~{tree.total_tokens()} tokens), "
+          f"ready in {time.perf_counter() - start:.2f}s")
+
+    prompt_path = os.path.abspath(os.path.expanduser(args.file)) if args.file else None
+    prompt_mtime = prompt_stamp(prompt_path)
+    socket_path = socket_file(args.session)
+    server = open_socket(socket_path)
+    print(f"Send prompts to {socket_path} (python watch.py -f <file>) or save them to {prompt_path}")
+
+    try:
+        while True:
+            readable = [server] + ([watcher] if watcher.fileno() is not None else [])
+            # Always wake up now and then: the prompt file may be outside the watched tree
+            ready, _, _ = select.select(readable, [], [], POLL_INTERVAL)
+
+            changed, rescan = watcher.read_changes() if watcher in ready or watcher.fileno() is None else (set(), False)
+            if changed or rescan:
+                tree.update(changed, rescan)
+
+            stamp = prompt_stamp(prompt_path)
+            if stamp != prompt_mtime:
+                prompt_mtime = stamp
+                user_prompt = read_prompt(prompt_path)
+                if user_prompt.strip():
+                    try:
+                        run_prompt(tree, user_prompt, args)
+                    except Exception as e:
+                        print(f"Error in processing: {e}")
+
+            if server in ready:
+                connection, _ = server.accept()
+                with connection:
+                    user_prompt = receive_prompt(connection)
+                    # Pick up anything that changed while the prompt was being typed
+                    changed, rescan = watcher.read_changes()
+                    if changed or rescan:
+                        tree.update(changed, rescan)
+                    try:
+                        reply = run_prompt(tree, user_prompt, args)
+                    except Exception as e:
+                        print(f"Error in processing: {e}")
+                        reply = f"Error in processing: {e}"
+                    try:
+                        connection.sendall(reply.encode('utf-8'))
+                    except OSError as e:
+                        if e.errno != errno.EPIPE:
+                            raise
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+def send_prompt(prompt, socket_path=SOCKET_FILE):
+    """Send a prompt to a running `conductor --watch` and return its response"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client:
+        client.connect(socket_path)
+        client.sendall(prompt.encode('utf-8'))
+        client.shutdown(socket.SHUT_WR)
+        return receive_prompt(client)
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a prompt to a running `conductor --watch`")
+    parser.add_argument('-f', '--file', help='File path to read prompt from (default: stdin)')
+    parser.add_argument('-s', '--socket', help=f"Daemon socket (default: {SOCKET_FILE})")
+    parser.add_argument('-S', '--session', help="Send to the daemon of this named session")
+    args = parser.parse_args()
+    socket_path = args.socket or socket_file(args.session)
+
+    if args.file:
+        with open(os.path.expanduser(args.file), 'r') as f:
+            prompt = f.read()
+    else:
+        prompt = sys.stdin.read()
+
+    try:
+        print(send_prompt(prompt, socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("No conductor is watching this directory, start one with `python conductor.py --watch`")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())